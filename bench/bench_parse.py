@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк парсинга профиля: быстрый lxml-путь против BeautifulSoup.
+
+Корпус — сохранённые страницы tanki.su (*.html) в одной папке.
+Записать корпус с живого сайта:
+    python bench/bench_parse.py --record --input participants.json --pages bench/pages
+Прогнать бенчмарк:
+    python bench/bench_parse.py --pages bench/pages --repeat 20
+"""
+
+import sys
+import time
+import pathlib
+import statistics
+import tracemalloc
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import scrape_lesta as sl  # noqa: E402
+
+def record(pages_dir: pathlib.Path, input_path: pathlib.Path, delay: float) -> None:
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    sess = sl.Session()
+    for job in sl.load_participants(input_path):
+        url = sl.build_profile_url(job["id"], job.get("name"))
+        try:
+            html = sl.fetch_html(url, session=sess)
+        except Exception as e:
+            print(f"{job['id']}: ERR {type(e).__name__}: {e}")
+            continue
+        (pages_dir / f"{job['id']}.html").write_text(html, encoding="utf-8")
+        print(f"{job['id']}: {len(html)} bytes")
+        time.sleep(delay)
+
+def _measure(fn, html: str, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(html)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+def bench(pages_dir: pathlib.Path, repeat: int) -> int:
+    pages = sorted(pages_dir.glob("*.html"))
+    if not pages:
+        print(f"В {pages_dir} нет *.html — сначала запиши корпус через --record")
+        return 1
+
+    paths = {"fast": sl._extract_stats_fast, "soup": sl._extract_stats_soup}
+    res = {k: {"t": [], "mem": []} for k in paths}
+    mismatches = 0
+
+    for p in pages:
+        html = p.read_text(encoding="utf-8")
+        fast = sl._extract_stats_fast(html)
+        soup = sl._extract_stats_soup(html)
+        if fast is not None and fast != soup:
+            mismatches += 1
+            print(f"  ! {p.name}: результаты fast и soup различаются")
+        for name, fn in paths.items():
+            t, mem = _measure(fn, html, repeat)
+            res[name]["t"].append(t)
+            res[name]["mem"].append(mem)
+
+    print(f"страниц: {len(pages)}, повторов: {repeat}")
+    print(f"{'путь':<6} {'median ms/стр':>14} {'p95 ms/стр':>11} {'peak KiB (median)':>18}")
+    for name, r in res.items():
+        ts = sorted(r["t"])
+        p95 = ts[min(len(ts) - 1, int(round(0.95 * (len(ts) - 1))))]
+        print(f"{name:<6} {statistics.median(ts) * 1000:>14.2f} {p95 * 1000:>11.2f} "
+              f"{statistics.median(r['mem']) / 1024:>18.1f}")
+    speedup = statistics.median(res["soup"]["t"]) / max(statistics.median(res["fast"]["t"]), 1e-9)
+    print(f"ускорение fast vs soup: x{speedup:.1f}; расхождений: {mismatches}")
+    return 1 if mismatches else 0
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Бенчмарк парсинга профилей tanki.su")
+    ap.add_argument("--pages", type=str, default=str(ROOT / "bench" / "pages"), help="Папка с *.html")
+    ap.add_argument("--repeat", type=int, default=10, help="Повторов на страницу (default: 10)")
+    ap.add_argument("--record", action="store_true", help="Скачать страницы участников в --pages")
+    ap.add_argument("--input", type=str, default=str(ROOT / "participants.json"), help="Список участников для --record")
+    ap.add_argument("--delay", type=float, default=1.5, help="Пауза между запросами при --record, сек")
+    args = ap.parse_args()
+
+    pages_dir = pathlib.Path(args.pages)
+    if args.record:
+        record(pages_dir, pathlib.Path(args.input), args.delay)
+        return 0
+    return bench(pages_dir, args.repeat)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Офлайн нагрузочный тест скрапера: локальный двойник tanki.su, r.jina.ai и API.
+
+Сервер отдаёт профили по /ru/community/accounts/<id>-<nick>/ (записанные
+страницы из --pages, иначе синтетические), Jina — по /jina/http/..., а
+официальный account/info — по /api/wot/account/info/ (с --api).
+Задержка, доли 403/429/5xx и "пустых" страниц (без статистики, чтобы
+сработали Playwright/Jina) настраиваются.
+
+    python bench/loadtest.py --accounts 300 --concurrency 8 --latency 150 \\
+        --p429 0.03 --p5xx 0.02 --p-empty 0.1
+    python bench/loadtest.py --accounts 1000 --api --p-api-missing 0.05
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import pathlib
+import tempfile
+import threading
+import statistics
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import scrape_lesta as sl  # noqa: E402
+
+PROFILE_PREFIX = "/ru/community/accounts/"
+JINA_PREFIX = "/jina/"
+API_PREFIX = "/api/wot/account/info/"
+
+def synthetic_profile(account_id: int, nickname: str, empty: bool = False) -> str:
+    rnd = random.Random(account_id)
+    items = [] if empty else [
+        ("Личный рейтинг", f"{rnd.randint(3000, 12000):,}".replace(",", " ")),
+        ("Бои", f"{rnd.randint(1000, 90000):,}".replace(",", " ")),
+        ("Победы", f"{rnd.uniform(45, 65):.2f}%".replace(".", ",")),
+        ("Средний урон", f"{rnd.randint(600, 3000):,}".replace(",", " ")),
+        ("Попадания", f"{rnd.uniform(55, 80):.2f}%".replace(".", ",")),
+        ("Средний опыт за бой", str(rnd.randint(400, 1200))),
+        ("Знаки классности «Мастер»", f"{rnd.randint(0, 400)} / {rnd.randint(400, 700)}"),
+    ]
+    stats = "".join(
+        f'<div class="stats_item"><div class="stats_value">{v}</div>'
+        f'<div class="stats_text">{k}</div></div>'
+        for k, v in items
+    )
+    filler = '<p class="news">Новости и события игры</p>' * 400
+    return (f"<html><head><title>{nickname}</title></head><body>"
+            f"<header>{filler}</header><h1>{nickname}</h1>"
+            f'<div class="stats_inner">{stats}</div><footer>{filler}</footer></body></html>')
+
+def jina_text(account_id: int, nickname: str) -> str:
+    rnd = random.Random(account_id)
+    return (f"Title: {nickname}\n\n"
+            f"Личный рейтинг {rnd.randint(3000, 12000)}\n"
+            f"Бои {rnd.randint(1000, 90000)}\n"
+            f"Процент побед {rnd.uniform(45, 65):.2f}%\n"
+            f"Средний урон {rnd.randint(600, 3000)}\n"
+            f"Процент попаданий {rnd.uniform(55, 80):.2f}%\n") + ("Новости и события игры. " * 40)
+
+def api_info(account_id: int) -> dict:
+    rnd = random.Random(account_id)
+    battles = rnd.randint(1000, 90000)
+    return {
+        "nickname": f"player_{account_id}",
+        "global_rating": rnd.randint(3000, 12000),
+        "statistics": {"all": {
+            "battles": battles,
+            "wins": int(battles * rnd.uniform(0.45, 0.65)),
+            "damage_dealt": battles * rnd.randint(600, 3000),
+            "frags": int(battles * rnd.uniform(0.5, 1.5)),
+            "survived_battles": int(battles * rnd.uniform(0.2, 0.5)),
+            "hits_percents": rnd.randint(55, 80),
+            "battle_avg_xp": rnd.randint(400, 1200),
+            "max_xp": rnd.randint(1500, 4000),
+            "max_frags": rnd.randint(5, 15),
+        }},
+    }
+
+class FakeSite:
+    """Двойник tanki.su + r.jina.ai в фоновом потоке."""
+
+    def __init__(self, pages_dir: pathlib.Path = None, latency_ms: float = 100.0,
+                 p403: float = 0.0, p429: float = 0.0, p5xx: float = 0.0,
+                 p_empty: float = 0.0, seed: int = 1, p_api_missing: float = 0.0):
+        self.pages = {}
+        if pages_dir and pages_dir.exists():
+            for p in sorted(pages_dir.glob("*.html")):
+                self.pages[p.stem] = p.read_text(encoding="utf-8")
+        self.latency = latency_ms / 1000.0
+        self.p403, self.p429, self.p5xx, self.p_empty = p403, p429, p5xx, p_empty
+        self.p_api_missing = p_api_missing
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hits: Counter = Counter()
+        self.httpd = None
+
+    def _roll(self) -> float:
+        with self.lock:
+            return self.rnd.random()
+
+    def _count(self, key: str) -> None:
+        with self.lock:
+            self.hits[key] += 1
+
+    def _page_for(self, account_id: int, nickname: str, empty: bool) -> str:
+        if empty:
+            return synthetic_profile(account_id, nickname, empty=True)
+        if self.pages:
+            recorded = self.pages.get(str(account_id))
+            if recorded is None:
+                keys = sorted(self.pages)
+                recorded = self.pages[keys[account_id % len(keys)]]
+            return recorded
+        return synthetic_profile(account_id, nickname)
+
+    def start(self) -> int:
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *a):
+                pass
+
+            def _send(self, code: int, body: str = "", ctype: str = "text/html; charset=utf-8", headers=None):
+                raw = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                time.sleep(site.latency * (0.5 + site._roll()))
+                if self.path.startswith(API_PREFIX):
+                    return self._api()
+                kind = "jina" if self.path.startswith(JINA_PREFIX) else "profile"
+
+                r = site._roll()
+                if r < site.p403:
+                    site._count(f"{kind}:403")
+                    return self._send(403, "Forbidden")
+                r -= site.p403
+                if r < site.p429:
+                    site._count(f"{kind}:429")
+                    return self._send(429, "Too Many Requests", headers={"Retry-After": "1"})
+                r -= site.p429
+                if r < site.p5xx:
+                    site._count(f"{kind}:5xx")
+                    return self._send(503, "Service Unavailable")
+
+                slug = self.path.rstrip("/").split("/")[-1]
+                acc_str, _, nick = slug.partition("-")
+                try:
+                    acc = int(acc_str)
+                except ValueError:
+                    site._count(f"{kind}:404")
+                    return self._send(404, "Not Found")
+
+                if kind == "jina":
+                    site._count("jina:200")
+                    return self._send(200, jina_text(acc, nick or str(acc)), "text/plain; charset=utf-8")
+                empty = site._roll() < site.p_empty
+                site._count("profile:empty" if empty else "profile:200")
+                return self._send(200, site._page_for(acc, nick or str(acc), empty))
+
+            def _api(self):
+                # Ошибки как у настоящего API: HTTP 200 и status=error
+                qs = parse_qs(urlparse(self.path).query)
+                if not qs.get("application_id"):
+                    site._count("api:error")
+                    body = {"status": "error", "error": {"code": 402, "message": "APPLICATION_ID_NOT_SPECIFIED"}}
+                    return self._send(200, json.dumps(body), "application/json")
+                r = site._roll()
+                if r < site.p429:
+                    site._count("api:limit")
+                    body = {"status": "error", "error": {"code": 407, "message": "REQUEST_LIMIT_EXCEEDED"}}
+                    return self._send(200, json.dumps(body), "application/json")
+                ids = [int(i) for i in qs.get("account_id", [""])[0].split(",") if i.strip().isdigit()]
+                data = {str(i): (None if site._roll() < site.p_api_missing else api_info(i)) for i in ids}
+                site._count("api:200")
+                return self._send(200, json.dumps({"status": "ok", "meta": {"count": len(ids)}, "data": data}),
+                                  "application/json")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.httpd.server_address[1]
+
+    def stop(self) -> None:
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+def run(args) -> int:
+    site = FakeSite(pathlib.Path(args.pages) if args.pages else None, args.latency,
+                    args.p403, args.p429, args.p5xx, args.p_empty, args.seed, args.p_api_missing)
+    port = site.start()
+    sl.BASE = f"http://127.0.0.1:{port}/ru/community/accounts"
+    sl.JINA = f"http://127.0.0.1:{port}/jina"
+    sl.API = f"http://127.0.0.1:{port}/api/wot"
+
+    jobs = [{"id": 1_000_000 + i, "name": f"player_{i}"} for i in range(args.accounts)]
+    traces = []
+    limiter = sl.HostRateLimiter(rate=args.rate, min_rate=args.min_rate, max_rate=args.max_rate)
+    pipeline = sl.PipelineStats()
+    with tempfile.TemporaryDirectory() as tmp:
+        sess = sl.Session()
+        t0 = time.monotonic()
+        async def _run():
+            rest = jobs
+            if args.api:
+                rest, _ = await sl.run_api_tier(jobs, pathlib.Path(tmp), "loadtest", session=sess,
+                                                traces=traces, verbose=args.verbose, limiter=limiter)
+            # тот же путь рендера, что в проде: общий пул страниц, режим из --render-mode
+            pool = sl.BrowserPool(size=args.render_pool, max_uses=args.render_recycle,
+                                  capture=args.render_mode == "capture")
+            parser = sl.ParserPool(args.parse_workers, args.parse_pool, pipeline)
+            try:
+                await sl.run_jobs(
+                    rest, pathlib.Path(tmp), session=sess,
+                    concurrency=args.concurrency, per_host=args.per_host,
+                    render=not args.no_render, traces=traces, verbose=args.verbose,
+                    limiter=limiter, parser=parser, pipeline=pipeline, pool=pool,
+                )
+            finally:
+                parser.close()
+                await pool.close()
+
+        try:
+            asyncio.run(_run())
+        finally:
+            wall = time.monotonic() - t0
+            site.stop()
+
+    lat = [t["seconds"] for t in traces]
+    status = Counter(t["status"] for t in traces)
+    tiers = Counter(t["tier"] or "none" for t in traces)
+    n = max(1, len(traces))
+
+    print(f"аккаунтов: {len(traces)}, время: {wall:.2f} с, профилей/с: {len(traces) / max(wall, 1e-9):.2f}")
+    print(f"латентность на аккаунт: p50 {sl._pct(lat, 0.5):.3f} с, p95 {sl._pct(lat, 0.95):.3f} с, "
+          f"max {max(lat) if lat else 0:.3f} с, mean {statistics.mean(lat) if lat else 0:.3f} с")
+    print("статусы: " + ", ".join(f"{k}={v}" for k, v in sorted(status.items())))
+    print("тиры:    " + ", ".join(f"{k}={v} ({100 * v / n:.0f}%)" for k, v in sorted(tiers.items())))
+    print("темп:    " + ", ".join(f"{h}: {st['rate']} req/s, ошибок {st['errors']}"
+                                    for h, st in limiter.snapshot().items()))
+    print("очереди: " + ", ".join(f"{k}: max {v['depthMax']}, avg {v['depthAvg']}, ждали {v['blockedSeconds']} с"
+                                    for k, v in pipeline.snapshot().items()))
+    print("сервер:  " + ", ".join(f"{k}={v}" for k, v in sorted(site.hits.items())))
+
+    if args.min_ok is not None and status.get("OK", 0) / n < args.min_ok:
+        print(f"FAIL: доля OK {status.get('OK', 0) / n:.2f} < {args.min_ok}")
+        return 1
+    return 0
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Офлайн нагрузочный тест scrape_lesta")
+    ap.add_argument("--accounts", type=int, default=100, help="Сколько аккаунтов прогнать (default: 100)")
+    ap.add_argument("--pages", type=str, default=str(ROOT / "bench" / "pages"), help="Записанные страницы (*.html)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--per-host", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=20.0, help="Стартовая скорость limiter'а, req/s на хост")
+    ap.add_argument("--min-rate", type=float, default=1.0, help="Нижняя граница скорости limiter'а, req/s на хост")
+    ap.add_argument("--max-rate", type=float, default=200.0, help="Потолок скорости limiter'а, req/s на хост")
+    ap.add_argument("--latency", type=float, default=100.0, help="Средняя задержка ответа, мс")
+    ap.add_argument("--p403", type=float, default=0.0, help="Доля ответов 403")
+    ap.add_argument("--p429", type=float, default=0.0, help="Доля ответов 429")
+    ap.add_argument("--p5xx", type=float, default=0.0, help="Доля ответов 503")
+    ap.add_argument("--p-empty", type=float, default=0.0, help="Доля профилей без статистики")
+    ap.add_argument("--no-render", action="store_true", help="Без Playwright-тира")
+    ap.add_argument("--render-pool", type=int, default=2, help="Сколько страниц Chromium держать в пуле (default: 2)")
+    ap.add_argument("--render-recycle", type=int, default=50, help="Пересоздавать страницу после N рендеров (default: 50)")
+    ap.add_argument("--render-mode", choices=("capture", "dom"), default="dom",
+                    help="Режим Playwright-тира, как у scrape_lesta (default: dom)")
+    ap.add_argument("--parse-pool", choices=("auto", "process", "thread", "inline"), default="auto",
+                    help="Где разбирать HTML (default: auto)")
+    ap.add_argument("--parse-workers", type=int, default=4, help="Размер пула парсеров (default: 4)")
+    ap.add_argument("--api", action="store_true", help="Первым тиром — account/info пачками (двойник API)")
+    ap.add_argument("--p-api-missing", type=float, default=0.0, help="Доля аккаунтов, которых нет в ответе API")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--min-ok", type=float, default=None, help="Упасть, если доля OK ниже (для CI)")
+    ap.add_argument("--verbose", action="store_true", help="Печатать строку на каждый аккаунт")
+    return run(ap.parse_args())
+
+if __name__ == "__main__":
+    sys.exit(main())
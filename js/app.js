@@ -31,6 +31,11 @@
   // ======== загрузка статистики ========
   let _indexCache = null;
   async function loadFromIndex(id) {
+    if (_indexCache === null) {
+      // сначала бандл (кэшируемый), потом старый index.json
+      const bundle = window.tournamentBundle ? await window.tournamentBundle : null;
+      if (bundle && Array.isArray(bundle.players)) _indexCache = { players: bundle.players };
+    }
     if (_indexCache === null) {
       try {
         const r = await fetch("stats/index.json", { cache: "no-store" });
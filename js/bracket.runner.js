@@ -66,8 +66,8 @@
 
   document.addEventListener('DOMContentLoaded', () => {
     setupBoard();
-    fetch(DATA_URL)
-      .then(r=>r.json())
+    Promise.resolve(window.tournamentBundle)
+      .then(b=> (b && b.playoff && Array.isArray(b.playoff.teams)) ? b.playoff : fetch(DATA_URL).then(r=>r.json()))
       .then(data=>{
         teamsBySeed = Object.fromEntries((data.teams||[]).map(t=>[t.seed, t]));
         seedInitialTeams();
@@ -0,0 +1,15 @@
+// js/bundle.loader.js
+// Один бандл вместо десятков запросов: stats/bundle-manifest.json (маленький,
+// ревалидируется) → stats/bundle.<hash>.json (имя меняется вместе с содержимым,
+// поэтому кэшируется браузером/CDN как обычная статика).
+// Если бандла нет — window.tournamentBundle резолвится в null, и каждый
+// скрипт идёт по старому пути (отдельные JSON).
+(function () {
+  const BASE = 'stats/';
+
+  window.tournamentBundle = fetch(`${BASE}bundle-manifest.json`, { cache: 'no-cache' })
+    .then(r => r.ok ? r.json() : null)
+    .then(m => (m && m.file) ? fetch(BASE + m.file) : null)
+    .then(r => (r && r.ok) ? r.json() : null)
+    .catch(() => null);
+})();
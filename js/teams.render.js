@@ -6,8 +6,8 @@
 
   const URL = 'data/teams.json';
 
-  fetch(`${URL}?v=${Date.now()}`, { cache: 'no-store' })
-    .then(r => r.json())
+  Promise.resolve(window.tournamentBundle)
+    .then(b => (b && Array.isArray(b.teams)) ? b : fetch(`${URL}?v=${Date.now()}`, { cache: 'no-store' }).then(r => r.json()))
     .then(data => render(Array.isArray(data?.teams) ? data.teams : []))
     .catch(() => render([]));
 
@@ -7,43 +7,103 @@
 Стратегия устойчивости:
 - Статика (requests + BS4).
 - Если ключевые поля пустые — Playwright с "мягким goto" и stealth.
+  В Playwright сначала ловим JSON-ответ SPA со статистикой (page.on("response")),
+  DOM читаем, только если он не пришёл.
 - Если и Playwright не дался — фолбэк Jina Reader (текстовая выдача).
 - Никогда не затираем хорошие JSON "нулём": при сбое оставляем старые.
 - index.json собираем как merge: старые + успешно обновлённые.
+- Свежие (--max-age) и неизменившиеся (ETag/Last-Modified/sha1 страницы) профили не трогаем.
+- Каждый результат с новой статистикой дописывается в историю (<out>/history.sqlite),
+  запросы к ней: `scrape_lesta.py history --deltas --since ...`.
+- Прогресс чекпоинтится в <out>/.journal.ndjson, упавший прогон продолжается через --resume.
+- TierRouter начинает аккаунт с тира, который сейчас работает; сломанный тир
+  выключается на время (circuit breaker), дешёвый тир периодически пробуем снова.
+- После прогона собирается stats/bundle.<hash>.json (index + teams + playoff
+  с агрегатами команд) для фронтенда, имя — в stats/bundle-manifest.json.
+- Большой ростер режется на шарды (--shard K/N, стабильный crc32 от accountId):
+  каждый шард пишет <out>/partial-K-of-N.json, `scrape_lesta.py merge` сливает их.
+- --priority/--budget: сначала игроки живых команд сетки, давно не обновлённые и
+  активные; при лимите запросов/времени на прогон важные карточки успевают всегда.
+- --stream: ростер (ndjson/csv/stdin) читается построчно и сразу идёт в очередь,
+  индекс пишется потоково из <out>/<id>.json — память не растёт с ростером.
+- `scrape_lesta.py serve`: демон с тёплым браузером и сессиями, обновляет игроков
+  по кругу и отдаёт index/игроков/бандл/данные сетки по локальному HTTP с ETag,
+  index.json и бандл на диске переписываются только при изменениях.
+- С application_id (--app-id / LESTA_APP_ID) первым тиром идёт официальный API:
+  account/info пачками по 100, в скрапинг уходят только те, кого нет в ответе.
+- Всё скачанное (HTML, DOM stats_map, текст Jina) ложится в <out>/.archive (gzip,
+  по sha256); `scrape_lesta.py reparse` пересобирает stats/ из архива без сети.
+- Конвейер: сеть → пул парсеров (процессы) → один писатель пачками; глубина
+  очередей и backpressure стадий — в run-report.json / scrape.prom.
+- Файлы пишутся атомарно и только при изменении статистики: если поменялся лишь
+  fetchedAt, <id>.json и index.json не трогаем, свежесть — в <out>/freshness.json;
+  --compact пишет JSON без отступов.
+- requests/bs4/Playwright грузятся при первом обращении к тиру. Перед прогоном —
+  быстрая проверка папки и Chromium (нет браузера — тир render выключается сразу);
+  --check ещё проверяет доступность хостов тиров.
+- Аккаунты идут параллельно (asyncio, --concurrency), с лимитом запросов на хост (--per-host).
 """
 
+import os
 import re
+import sys
+import gzip
 import json
 import time
 import random
 import asyncio
 import pathlib
-from datetime import datetime, timezone
-from typing import Dict, Optional, Iterable, Tuple, List
-
-from bs4 import BeautifulSoup
-import requests
+import hashlib
+import tempfile
+import sqlite3
+import zlib
+import signal
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlparse
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Iterable, Tuple, List
+
+if TYPE_CHECKING:  # только для аннотаций "requests.Session"/"requests.Response"
+    import requests
+
+# requests, bs4, lxml и Playwright импортируются при первом обращении к своему тиру:
+# history/merge/--check и прогоны на пару аккаунтов не платят за то, чем не пользуются.
+def _requests():
+    import requests
+    return requests
 
 # Если начнутся 403 — можно использовать cloudscraper:
 # import cloudscraper
 # Session = cloudscraper.create_scraper  # type: ignore
-Session = requests.Session
+def Session():
+    return _requests().Session()
 
 BASE = "https://tanki.su/ru/community/accounts"
+JINA = "https://r.jina.ai"
+API = "https://api.tanki.su/wot"  # официальный API Lesta; application_id — --app-id или LESTA_APP_ID
 
 # ─────────────────────────────────────────────
 # Утилиты чисел / нормализации
 
+_NUM_JUNK_RX = re.compile(r"[^0-9,.\-]")
+_THOUSANDS_RX = re.compile(r"(?<=\d)[\s.](?=\d{3}(\D|$))")
+_LABEL_PUNCT_RX = re.compile(r"[«»\"'’–—:]+")
+_SPACES_RX = re.compile(r"\s+")
+_MASTER_RX = re.compile(r"\s*([\d\s.,]+)\s*/\s*([\d\s.,]+)\s*$")
+
 def _clean_num(s: Optional[str]) -> Optional[float]:
     if not s:
         return None
     s = s.replace("\xa0", " ").strip()
-    m = re.sub(r"[^0-9,.\-]", "", s)
+    m = _NUM_JUNK_RX.sub("", s)
     if not m:
         return None
     if m.count(",") == 1 and "." not in m:
         m = m.replace(",", ".")
-    m = re.sub(r"(?<=\d)[\s.](?=\d{3}(\D|$))", "", m)
+    m = _THOUSANDS_RX.sub("", m)
     try:
         return float(m)
     except ValueError:
@@ -53,10 +113,12 @@ def _clean_int(s: Optional[str]) -> Optional[int]:
     f = _clean_num(s)
     return int(round(f)) if f is not None else None
 
+@lru_cache(maxsize=1024)
 def _norm_label(s: str) -> str:
+    # подписей на странице десяток, и они одинаковые у всех игроков — кэшируем
     s = s.replace("\xa0", " ")
-    s = re.sub(r"[«»\"'’–—:]+", " ", s)
-    s = re.sub(r"\s+", " ", s.strip().lower())
+    s = _LABEL_PUNCT_RX.sub(" ", s)
+    s = _SPACES_RX.sub(" ", s.strip().lower())
     return s
 
 # ─────────────────────────────────────────────
@@ -70,6 +132,21 @@ RX = {
     "rating": re.compile(r"(?:WTR|GR|Рейтинг|РЭ|Личный\s*рейтинг)[^0-9]*([0-9\s.,]+)", re.I),
 }
 
+@contextmanager
+def _phase(trace: Optional[Dict], name: str):
+    """Копит длительность фазы в trace["phases"][name] (если trace передан)."""
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            phases = trace.setdefault("phases", {})
+            phases[name] = phases.get(name, 0.0) + (time.monotonic() - t0)
+
+def _count(trace: Optional[Dict], key: str, n: int = 1) -> None:
+    if trace is not None:
+        trace[key] = trace.get(key, 0) + n
+
 def build_profile_url(account_id: int, nickname: Optional[str] = None) -> str:
     slug = f"{account_id}-{nickname}" if nickname else str(account_id)
     return f"{BASE}/{slug}/"
@@ -77,105 +154,436 @@ def build_profile_url(account_id: int, nickname: Optional[str] = None) -> str:
 # ─────────────────────────────────────────────
 # HTTP (requests)
 
-def fetch_html(url: str, session: Optional[requests.Session] = None, timeout=30) -> str:
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/121.0 Safari/537.36"
+    ),
+    "Accept-Language": "ru,en;q=0.9",
+    "Referer": "https://tanki.su/",
+}
+
+def _get_once(url: str, session=None, timeout=30, extra_headers: Optional[Dict[str, str]] = None):
+    sess = session or Session()
+    headers = dict(HEADERS)
+    if extra_headers:
+        headers.update(extra_headers)
+    return sess.get(url, headers=headers, timeout=timeout)
+
+def fetch_page(url: str, session: Optional["requests.Session"] = None, timeout=30,
+               extra_headers: Optional[Dict[str, str]] = None,
+               trace: Optional[Dict] = None) -> "requests.Response":
+    """GET с ретраями. 304 (на условный запрос) — не ошибка, отдаём как есть.
+
+    Паузы между попытками — экспоненциальные, но не меньше Retry-After.
+    В trace копятся retries и bytes.
+    """
     sess = session or Session()
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/121.0 Safari/537.36"
-        ),
-        "Accept-Language": "ru,en;q=0.9",
-        "Referer": "https://tanki.su/",
-    }
     last_err = None
     for i in range(3):
         try:
-            resp = sess.get(url, headers=headers, timeout=timeout)
+            resp = _get_once(url, sess, timeout, extra_headers)
+            _count(trace, "bytes", len(resp.content))
             resp.raise_for_status()
-            return resp.text
+            return resp
+        except Exception as e:
+            last_err = e
+            if i < 2:
+                _count(trace, "retries")
+                time.sleep(max(_retry_after(getattr(e, "response", None)) or 0.0, 2.0 ** i))
+    raise last_err  # type: ignore[misc]
+
+# Дольше не ждём, что бы ни прислал сервер: Retry-After: 86400 не должен усыплять прогон на сутки
+RETRY_AFTER_MAX = 120.0
+
+def _retry_after(resp) -> Optional[float]:
+    """Retry-After в секундах (число или HTTP-дата, не больше RETRY_AFTER_MAX); None — заголовка нет."""
+    v = resp.headers.get("Retry-After") if resp is not None else None
+    if not v:
+        return None
+    try:
+        secs = float(v)
+    except ValueError:
+        try:
+            secs = (parsedate_to_datetime(v) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, secs), RETRY_AFTER_MAX)
+
+def fetch_html(url: str, session: Optional["requests.Session"] = None, timeout=30) -> str:
+    return fetch_page(url, session=session, timeout=timeout).text
+
+# ─────────────────────────────────────────────
+# Адаптивный rate limiter (token bucket + AIMD) на хост
+
+class HostRateLimiter:
+    """Token bucket на хост; скорость подстраивается по ответам сервера (AIMD).
+
+    Быстрые успешные ответы — rate += increase (аддитивный рост).
+    429/403 — rate *= decrease, 5xx/сетевая ошибка — мягче (×0.8); после
+    любой из них пауза до следующего запроса (Retry-After, если сервер
+    его прислал, но не больше RETRY_AFTER_MAX, иначе 1/rate).
+    Латентность выше slow_factor × обычной — тоже мягкое торможение (×0.8).
+    """
+
+    def __init__(self, rate: float = 1.0, min_rate: float = 0.1, max_rate: float = 5.0,
+                 burst: float = 1.0, increase: float = 0.1, decrease: float = 0.5,
+                 slow_factor: float = 3.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.burst = max(1.0, burst)
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_factor = slow_factor
+        self.hosts: Dict[str, Dict] = {}
+
+    def _state(self, url: str) -> Dict:
+        host = (urlparse(url).hostname or "").lower()
+        st = self.hosts.get(host)
+        if st is None:
+            st = self.hosts[host] = {
+                "rate": self.rate, "tokens": 1.0, "last": time.monotonic(),
+                "blockedUntil": 0.0, "latency": None, "ok": 0, "errors": 0,
+            }
+        return st
+
+    async def acquire(self, url: str) -> None:
+        st = self._state(url)
+        while True:
+            now = time.monotonic()
+            st["tokens"] = min(self.burst, st["tokens"] + (now - st["last"]) * st["rate"])
+            st["last"] = now
+            wait = st["blockedUntil"] - now
+            if wait <= 0:
+                if st["tokens"] >= 1.0:
+                    st["tokens"] -= 1.0
+                    return
+                wait = (1.0 - st["tokens"]) / st["rate"]
+            # немного джиттера, чтобы воркеры не просыпались строем
+            await asyncio.sleep(wait * random.uniform(1.0, 1.15))
+
+    def feedback(self, url: str, status: Optional[int], latency: float,
+                 retry_after: Optional[float] = None) -> None:
+        st = self._state(url)
+        now = time.monotonic()
+        if status is None or status in (403, 429) or status >= 500:
+            st["errors"] += 1
+            factor = self.decrease if status in (403, 429) else 0.8
+            st["rate"] = max(self.min_rate, st["rate"] * factor)
+            st["tokens"] = 0.0
+            pause = min(retry_after, RETRY_AFTER_MAX) if retry_after is not None else 1.0 / st["rate"]
+            st["blockedUntil"] = max(st["blockedUntil"], now + pause)
+            return
+        st["ok"] += 1
+        base = st["latency"]
+        st["latency"] = latency if base is None else 0.8 * base + 0.2 * latency
+        if base is not None and latency > self.slow_factor * base:
+            st["rate"] = max(self.min_rate, st["rate"] * 0.8)
+        else:
+            st["rate"] = min(self.max_rate, st["rate"] + self.increase)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {
+            h: {"rate": round(st["rate"], 3), "ok": st["ok"], "errors": st["errors"],
+                "latency": round(st["latency"], 3) if st["latency"] is not None else None}
+            for h, st in self.hosts.items()
+        }
+
+async def fetch_page_async(url: str, session=None, limiter: Optional[HostRateLimiter] = None,
+                           extra_headers: Optional[Dict[str, str]] = None,
+                           trace: Optional[Dict] = None, attempts: int = 3, timeout=30):
+    """Асинхронный fetch_page: каждая попытка проходит через limiter, паузы между
+    попытками тоже задаёт он (по статусу и Retry-After)."""
+    limiter = limiter or HostRateLimiter()
+    last_err: Optional[Exception] = None
+    for i in range(attempts):
+        await limiter.acquire(url)
+        _count(trace, "requests")
+        t0 = time.monotonic()
+        try:
+            resp = await asyncio.to_thread(_get_once, url, session, timeout, extra_headers)
         except Exception as e:
+            limiter.feedback(url, None, time.monotonic() - t0)
             last_err = e
-            time.sleep(1.0 * (i + 1))
+        else:
+            limiter.feedback(url, resp.status_code, time.monotonic() - t0, _retry_after(resp))
+            _count(trace, "bytes", len(resp.content))
+            try:
+                resp.raise_for_status()
+                return resp
+            except Exception as e:
+                last_err = e
+        if i < attempts - 1:
+            _count(trace, "retries")
     raise last_err  # type: ignore[misc]
 
 # ─────────────────────────────────────────────
 # Рендер + чтение значений прямо из DOM (Playwright с улучшениями)
 
-async def safe_goto(page, url: str) -> None:
-    """Мягкая навигация с тремя режимами ожидания и бэкоффом."""
+async def safe_goto(page, url: str):
+    """Мягкая навигация с тремя режимами ожидания и бэкоффом. Возвращает Response."""
     modes = [("commit", 30000), ("domcontentloaded", 60000), ("load", 120000)]
     for i, (wait_until, tm) in enumerate(modes):
         try:
-            await page.goto(url, wait_until=wait_until, timeout=tm)
-            return
+            return await page.goto(url, wait_until=wait_until, timeout=tm)
         except Exception:
             if i == len(modes) - 1:
                 raise
             await asyncio.sleep(1.5 * (i + 1))
 
-async def _render_and_grab_dom_async(url: str) -> Tuple[Dict[str, str], Optional[str]]:
-    from playwright.async_api import async_playwright
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--no-sandbox",
-                "--disable-dev-shm-usage",
-            ],
-        )
-        context = await browser.new_context(
-            ignore_https_errors=True,
-            user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/121.0 Safari/537.36"),
-            locale="ru-RU",
-            viewport={"width": 1280, "height": 900},
-            extra_http_headers={
-                "Accept-Language": "ru,en;q=0.9",
-                "Referer": "https://tanki.su/",
-            },
-        )
+UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+      "AppleWebKit/537.36 (KHTML, like Gecko) "
+      "Chrome/121.0 Safari/537.36")
+
+async def _launch_browser(p):
+    return await p.chromium.launch(
+        headless=True,
+        args=[
+            "--disable-blink-features=AutomationControlled",
+            "--no-sandbox",
+            "--disable-dev-shm-usage",
+        ],
+    )
+
+# Счётчики/реклама: SPA профиля без них работает, а грузятся они дольше всего
+TRACKER_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "mc.yandex.ru",
+    "top-fwz1.mail.ru", "vk.com", "facebook.net", "hotjar.com",
+)
+
+async def _new_context(browser, lean: bool = False):
+    """lean=True (режим перехвата): ещё режем стили и скрипты счётчиков —
+    нужны только скрипты самого сайта, которые делают XHR за статистикой."""
+    context = await browser.new_context(
+        ignore_https_errors=True,
+        user_agent=UA,
+        locale="ru-RU",
+        viewport={"width": 1280, "height": 900},
+        extra_http_headers={
+            "Accept-Language": "ru,en;q=0.9",
+            "Referer": "https://tanki.su/",
+        },
+    )
+
+    # stealth: прячем "webdriver", задаём языки/платформу
+    await context.add_init_script("""
+        Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+        window.chrome = { runtime: {} };
+        Object.defineProperty(navigator, 'languages', {get: () => ['ru-RU','ru','en-US','en']});
+        Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
+    """)
+
+    # Блокируем только картинки/медиа (шрифты НЕ блокируем!)
+    async def _route(route, request):
+        if request.resource_type in ("image", "media"):
+            await route.abort()
+        elif lean and (request.resource_type == "stylesheet"
+                       or any(h in (urlparse(request.url).hostname or "") for h in TRACKER_HOSTS)):
+            await route.abort()
+        else:
+            await route.continue_()
+    await context.route("**/*", _route)
+    return context
 
-        # stealth: прячем "webdriver", задаём языки/платформу
-        await context.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-            window.chrome = { runtime: {} };
-            Object.defineProperty(navigator, 'languages', {get: () => ['ru-RU','ru','en-US','en']});
-            Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
-        """)
+# ─────────────────────────────────────────────
+# Перехват JSON-ответов SPA вместо ожидания DOM
+
+CAPTURE_TIMEOUT = 15.0  # сек после goto; не пришло — читаем DOM как раньше
+
+# ключ в JSON профиля → метка из .stats_inner (её понимает _map_stats_to_data)
+CAPTURE_KEYS = {
+    "battles": ("battles", "battles_count", "battlesCount"),
+    "wins": ("wins", "wins_count", "winsCount"),
+    "winRate": ("wins_percent", "winRate", "win_rate", "winsPercent"),
+    "avgDmg": ("avg_damage", "damage_avg", "avgDamage", "average_damage"),
+    "damage": ("damage_dealt", "damageDealt"),
+    "hits": ("hits_percents", "hits_percent", "hitsPercent", "hitsPercents"),
+    "rating": ("global_rating", "personal_rating", "globalRating", "personalRating"),
+    "avgExp": ("battle_avg_xp", "avg_xp", "avgXp", "battleAvgXp"),
+    "maxExp": ("max_xp", "maxXp"),
+    "maxFrags": ("max_frags", "maxFrags"),
+    "nickname": ("nickname",),
+}
 
-        page = await context.new_page()
+# Берутся не из самого блока боёв, а с пути к нему: у аккаунта рейтинг и ник лежат
+# уровнем выше statistics.all
+CAPTURE_OWNER_FIELDS = ("rating", "nickname")
 
-        # Блокируем только картинки/медиа (шрифты НЕ блокируем!)
-        async def _route(route, request):
-            if request.resource_type in ("image", "media"):
-                await route.abort()
+def _pick_fields(obj: Dict, found: Dict[str, object], fields: Iterable[str]) -> None:
+    for field in fields:
+        if field in found:
+            continue
+        for k in CAPTURE_KEYS[field]:
+            v = obj.get(k)
+            if field == "nickname":
+                ok = isinstance(v, str) and bool(v)
             else:
-                await route.continue_()
-        await context.route("**/*", _route)
-
-        # Мягкий goto
-        await safe_goto(page, url)
-
-        # Best effort: cookie-баннеры
-        for sel in [
-            'button:has-text("Соглас")',
-            'button:has-text("Принять")',
-            '[data-qa*="cookie"] button',
-            '#cookie_policy_button',
-            '.cookie-accept, .cookies-accept, .cookies__button',
-        ]:
-            try:
-                btn = page.locator(sel)
-                if await btn.count() > 0:
-                    await btn.first.click(timeout=1500)
+                ok = isinstance(v, (int, float)) and not isinstance(v, bool)
+            if ok:
+                found[field] = v
+                break
+
+def _find_keys(obj, found: Dict[str, object], max_depth: int = 8) -> None:
+    """Поля статистики из одного объекта — самого мелкого dict с числом боёв.
+
+    Обход в ширину: сводка аккаунта (statistics.all) находится раньше, чем
+    записи по отдельным танкам, а поля соседних веток не смешиваются.
+    Рейтинг и ник ещё ищем у предков найденного блока.
+    """
+    level = [(obj, ())]
+    for _ in range(max_depth + 1):
+        nxt = []
+        for node, parents in level:
+            if isinstance(node, dict):
+                if any(isinstance(node.get(k), (int, float)) and not isinstance(node.get(k), bool)
+                       for k in CAPTURE_KEYS["battles"]):
+                    _pick_fields(node, found, CAPTURE_KEYS)
+                    for parent in reversed(parents):
+                        _pick_fields(parent, found, CAPTURE_OWNER_FIELDS)
+                    return
+                nxt.extend((v, parents + (node,)) for v in node.values() if isinstance(v, (dict, list)))
+            elif isinstance(node, list):
+                nxt.extend((v, parents) for v in node[:50] if isinstance(v, (dict, list)))
+        if not nxt:
+            return
+        level = nxt
+
+def _stats_from_payload(payload, account_id: Optional[int] = None) -> Optional[Tuple[Dict[str, str], Optional[str]]]:
+    """JSON из XHR профиля → (stats_map с метками .stats_inner, ник) или None.
+
+    Если в ответе есть ветка с ключом accountId — ищем только в ней (в том же
+    ответе бывают соклановцы). Нужны бои и рейтинг или урон, иначе не наш ответ.
+    """
+    if account_id is not None and isinstance(payload, dict):
+        stack = [payload]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                if str(account_id) in node:
+                    payload = node[str(account_id)]
                     break
-            except:
-                pass
+                stack.extend(v for v in node.values() if isinstance(v, (dict, list)))
+            elif isinstance(node, list):
+                stack.extend(v for v in node if isinstance(v, (dict, list)))
+    found: Dict[str, object] = {}
+    _find_keys(payload, found)
+    battles = found.get("battles")
+    if not battles or not (found.get("rating") or found.get("avgDmg") or found.get("damage")):
+        return None
 
-        # Ждём реальных числовых значений
+    def num(v, nd=2) -> str:
+        return str(int(v)) if float(v).is_integer() else f"{float(v):.{nd}f}"
+
+    stats: Dict[str, str] = {"бои": num(battles)}
+    if found.get("winRate") is not None:
+        stats["победы"] = num(found["winRate"]) + "%"
+    elif found.get("wins") is not None:
+        stats["победы"] = f"{100.0 * float(found['wins']) / float(battles):.2f}%"
+    if found.get("avgDmg") is not None:
+        stats["средний урон"] = num(round(float(found["avgDmg"])))
+    elif found.get("damage") is not None:
+        stats["средний урон"] = str(int(round(float(found["damage"]) / float(battles))))
+    if found.get("hits") is not None:
+        stats["попадания"] = num(found["hits"]) + "%"
+    if found.get("rating") is not None:
+        stats["личный рейтинг"] = num(found["rating"])
+    for field, label in (("avgExp", "средний опыт за бой"), ("maxExp", "максимальный опыт за бой"),
+                         ("maxFrags", "максимум уничтожено за бой")):
+        if found.get(field) is not None:
+            stats[label] = num(round(float(found[field])))
+    nick = found.get("nickname")
+    return stats, (nick if isinstance(nick, str) else None)
+
+class _StatsCapture:
+    """page.on("response"): первый JSON-ответ xhr/fetch, похожий на статистику профиля."""
+
+    def __init__(self, page, account_id: Optional[int]):
+        self.page = page
+        self.account_id = account_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._tasks: set = set()
+        page.on("response", self._on_response)
+
+    def _on_response(self, resp) -> None:
+        if self.future.done():
+            return
+        try:
+            if resp.request.resource_type not in ("xhr", "fetch"):
+                return
+            if "json" not in (resp.headers.get("content-type") or ""):
+                return
+        except Exception:
+            return
+        task = asyncio.ensure_future(self._read(resp))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read(self, resp) -> None:
+        try:
+            payload = await resp.json()
+        except Exception:
+            return
+        found = _stats_from_payload(payload, self.account_id)
+        if found and not self.future.done():
+            self.future.set_result(found)
+
+    async def wait(self, timeout: float) -> Optional[Tuple[Dict[str, str], Optional[str]]]:
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        try:
+            self.page.remove_listener("response", self._on_response)
+        except Exception:
+            pass
+        for task in list(self._tasks):
+            task.cancel()
+
+async def _grab_dom(page, url: str, trace: Optional[Dict] = None,
+                    capture_id: Optional[int] = None) -> Tuple[Dict[str, str], Optional[str]]:
+    """capture_id — accountId для режима перехвата: ждём JSON-ответ со
+    статистикой и выходим сразу; не пришёл за CAPTURE_TIMEOUT — DOM как раньше."""
+    capture = _StatsCapture(page, capture_id) if capture_id is not None else None
+    try:
+        # Мягкий goto
+        with _phase(trace, "render_goto"):
+            nav = await safe_goto(page, url)
+        if trace is not None and nav is not None:
+            trace["renderStatus"] = nav.status
+        if capture is not None:
+            with _phase(trace, "render_capture"):
+                got = await capture.wait(CAPTURE_TIMEOUT)
+            if got is not None:
+                if trace is not None:
+                    trace["renderVia"] = "capture"
+                return got
+    finally:
+        if capture is not None:
+            capture.close()
+    if trace is not None:
+        trace["renderVia"] = "dom"
+
+    # Best effort: cookie-баннеры
+    for sel in [
+        'button:has-text("Соглас")',
+        'button:has-text("Принять")',
+        '[data-qa*="cookie"] button',
+        '#cookie_policy_button',
+        '.cookie-accept, .cookies-accept, .cookies__button',
+    ]:
+        try:
+            btn = page.locator(sel)
+            if await btn.count() > 0:
+                await btn.first.click(timeout=1500)
+                break
+        except:
+            pass
+
+    # Ждём реальных числовых значений
+    with _phase(trace, "render_wait"):
         await page.wait_for_selector(".stats_inner .stats_item .stats_value", timeout=60000)
         await page.wait_for_function(
             """() => {
@@ -186,6 +594,7 @@ async def _render_and_grab_dom_async(url: str) -> Tuple[Dict[str, str], Optional
             timeout=60000
         )
 
+    with _phase(trace, "render_eval"):
         result = await page.evaluate("""() => {
             const out = {};
             document.querySelectorAll('.stats_inner .stats_item').forEach(it => {
@@ -198,10 +607,111 @@ async def _render_and_grab_dom_async(url: str) -> Tuple[Dict[str, str], Optional
             return {stats: out, nickname};
         }""")
 
-        await context.close()
-        await browser.close()
+    return result.get("stats", {}), result.get("nickname")
+
+class _PageSlot:
+    __slots__ = ("context", "page", "uses")
+
+    def __init__(self):
+        self.context = None
+        self.page = None
+        self.uses = 0
+
+class BrowserPool:
+    """Один долгоживущий Chromium на весь прогон + пул контекстов/страниц.
+
+    Браузер стартует лениво, при первом рендере. Страница пересоздаётся
+    после max_uses рендеров или после любой ошибки; упавший браузер
+    перезапускается. capture=True — режим перехвата XHR (см. _grab_dom),
+    контексты тогда «постные»: без стилей и счётчиков.
+    """
+
+    def __init__(self, size: int = 2, max_uses: int = 50, capture: bool = False):
+        self.size = max(1, int(size))
+        self.max_uses = max(1, int(max_uses))
+        self.capture = capture
+        self._pw_cm = None
+        self._pw = None
+        self._browser = None
+        self._lock = asyncio.Lock()
+        self._slots: Optional["asyncio.Queue[_PageSlot]"] = None
+
+    async def _ensure_browser(self, trace: Optional[Dict] = None):
+        async with self._lock:
+            if self._slots is None:
+                self._slots = asyncio.Queue()
+                for _ in range(self.size):
+                    self._slots.put_nowait(_PageSlot())
+            if self._pw is None:
+                from playwright.async_api import async_playwright
+                self._pw_cm = async_playwright()
+                self._pw = await self._pw_cm.start()
+            if self._browser is None or not self._browser.is_connected():
+                with _phase(trace, "render_launch"):
+                    self._browser = await _launch_browser(self._pw)
+
+    async def _drop_slot(self, slot: _PageSlot) -> None:
+        if slot.context is not None:
+            try:
+                await slot.context.close()
+            except Exception:
+                pass
+        slot.context = slot.page = None
+        slot.uses = 0
 
-        return result.get("stats", {}), result.get("nickname")
+    async def render(self, url: str, trace: Optional[Dict] = None,
+                     account_id: Optional[int] = None) -> Tuple[Dict[str, str], Optional[str]]:
+        await self._ensure_browser(trace)
+        slot = await self._slots.get()
+        try:
+            if slot.page is None or slot.page.is_closed():
+                await self._drop_slot(slot)
+                await self._ensure_browser(trace)
+                with _phase(trace, "render_page"):
+                    slot.context = await _new_context(self._browser, lean=self.capture)
+                    slot.page = await slot.context.new_page()
+            try:
+                result = await _grab_dom(slot.page, url, trace, account_id if self.capture else None)
+            except Exception:
+                # страница/контекст могли умереть — в следующий раз начнём с чистого
+                await self._drop_slot(slot)
+                raise
+            slot.uses += 1
+            if slot.uses >= self.max_uses:
+                await self._drop_slot(slot)
+            return result
+        finally:
+            self._slots.put_nowait(slot)
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._slots is not None:
+                while not self._slots.empty():
+                    await self._drop_slot(self._slots.get_nowait())
+                self._slots = None
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+                self._browser = None
+            if self._pw_cm is not None:
+                try:
+                    await self._pw_cm.__aexit__(None, None, None)
+                except Exception:
+                    pass
+                self._pw_cm = self._pw = None
+
+async def _render_and_grab_dom_async(url: str, trace: Optional[Dict] = None,
+                                     account_id: Optional[int] = None,
+                                     capture: bool = False) -> Tuple[Dict[str, str], Optional[str]]:
+    """Разовый рендер без общего пула. capture=True — экспериментальный перехват
+    (нужен account_id), по умолчанию — DOM, как --render-mode dom."""
+    pool = BrowserPool(size=1, max_uses=1, capture=capture and account_id is not None)
+    try:
+        return await pool.render(url, trace, account_id)
+    finally:
+        await pool.close()
 
 def fetch_stats_rendered(url: str) -> Tuple[Dict[str, str], Optional[str]]:
     try:
@@ -212,32 +722,187 @@ def fetch_stats_rendered(url: str) -> Tuple[Dict[str, str], Optional[str]]:
 # ─────────────────────────────────────────────
 # Фолбэк через Jina Reader (текст из отрендерённой страницы)
 
+def _jina_url(url: str) -> str:
+    return f"{JINA}/http/" + url.replace("https://", "").rstrip("/")
+
+def _jina_get(url: str, timeout=60) -> "requests.Response":
+    return _requests().get(
+        _jina_url(url), timeout=timeout,
+        headers={"User-Agent": "Mozilla/5.0", "Accept-Language": "ru,en;q=0.9"}
+    )
+
+def _jina_text(r) -> Optional[str]:
+    return r.text if (r.ok and len(r.text) > 500) else None
+
 def fetch_via_jina_text(url: str, timeout=60) -> Optional[str]:
     try:
         # Jina Reader: вернёт текст страницы, часто обходит сетевые капризы
-        proxied = "https://r.jina.ai/http/" + url.replace("https://", "").rstrip("/")
-        r = requests.get(
-            proxied, timeout=timeout,
-            headers={"User-Agent": "Mozilla/5.0", "Accept-Language": "ru,en;q=0.9"}
-        )
-        if r.ok and len(r.text) > 500:
-            return r.text
+        return _jina_text(_jina_get(url, timeout))
     except Exception:
         pass
     return None
 
+async def fetch_via_jina_text_async(url: str, limiter: Optional[HostRateLimiter] = None,
+                                    timeout=60) -> Optional[str]:
+    limiter = limiter or HostRateLimiter()
+    proxied = _jina_url(url)
+    await limiter.acquire(proxied)
+    t0 = time.monotonic()
+    try:
+        r = await asyncio.to_thread(_jina_get, url, timeout)
+    except Exception:
+        limiter.feedback(proxied, None, time.monotonic() - t0)
+        return None
+    limiter.feedback(proxied, r.status_code, time.monotonic() - t0, _retry_after(r))
+    return _jina_text(r)
+
+# ─────────────────────────────────────────────
+# Официальный API: account/info пачками до 100 аккаунтов
+
+API_BATCH = 100
+API_FIELDS = (
+    "nickname", "global_rating",
+    "statistics.all.battles", "statistics.all.wins", "statistics.all.damage_dealt",
+    "statistics.all.frags", "statistics.all.survived_battles", "statistics.all.hits_percents",
+    "statistics.all.battle_avg_xp", "statistics.all.max_xp", "statistics.all.max_frags",
+)
+# В account/info этого нет — переносим из прошлой записи
+API_CARRY_OVER = ("masterCount", "vehiclesCount")
+
+def api_app_id(explicit: Optional[str] = None) -> Optional[str]:
+    return explicit or os.environ.get("LESTA_APP_ID") or None
+
+def _api_url(ids: Iterable[int], app_id: str) -> str:
+    query = urlencode({
+        "application_id": app_id,
+        "account_id": ",".join(str(i) for i in ids),
+        "fields": ",".join(API_FIELDS),
+    })
+    return f"{API}/account/info/?{query}"
+
+def _map_api_account(info: Dict, nickname: Optional[str], prev: Optional[Dict] = None) -> Dict:
+    """Ответ account/info по одному аккаунту → та же схема, что у _map_stats_to_data."""
+    st = ((info.get("statistics") or {}).get("all") or {})
+    battles = int(st.get("battles") or 0)
+    wins = st.get("wins")
+
+    def per_battle(v, nd=None):
+        if not battles or v is None:
+            return None
+        return round(v / battles, nd) if nd is not None else int(round(v / battles))
+
+    data = {
+        "nickname": info.get("nickname") or nickname,
+        "battles": battles,
+        "wins": wins,
+        "winRate": round(100.0 * wins / battles, 2) if battles and wins is not None else 0.0,
+        "avgDmg": per_battle(st.get("damage_dealt")) or 0,
+        "avgFrags": per_battle(st.get("frags"), 2),
+        "surviveRate": round(100.0 * st["survived_battles"] / battles, 2)
+        if battles and st.get("survived_battles") is not None else None,
+        "hitsPercents": st.get("hits_percents"),
+        "global_rating": int(info.get("global_rating") or 0),
+        "avgExp": st.get("battle_avg_xp"),
+        "maxExp": st.get("max_xp"),
+        "maxFrags": st.get("max_frags"),
+    }
+    for key in API_CARRY_OVER:
+        data[key] = (prev or {}).get(key)
+    return data
+
+async def fetch_api_batch(ids: List[int], app_id: str, session=None,
+                          limiter: Optional[HostRateLimiter] = None,
+                          trace: Optional[Dict] = None) -> Dict[int, Optional[Dict]]:
+    """Один запрос account/info. {accountId: info или None (нет в ответе)}.
+
+    Ошибки API приходят с HTTP 200 и status=error: лимит запросов отдаём
+    limiter'у как 429, остальное — исключением (тогда вся пачка идёт в скрапинг).
+    """
+    limiter = limiter or HostRateLimiter()
+    url = _api_url(ids, app_id)
+    for _ in range(3):
+        resp = await fetch_page_async(url, session, limiter, None, trace)
+        payload = resp.json()
+        if payload.get("status") == "ok":
+            data = payload.get("data") or {}
+            return {i: data.get(str(i)) for i in ids}
+        err = payload.get("error") or {}
+        if err.get("message") == "REQUEST_LIMIT_EXCEEDED":
+            limiter.feedback(url, 429, 0.0)
+            _count(trace, "retries")
+            continue
+        raise RuntimeError(f"API error: {err.get('code')} {err.get('message')}")
+    raise RuntimeError("API error: REQUEST_LIMIT_EXCEEDED")
+
 # ─────────────────────────────────────────────
 # Парсинг из сырого HTML (статический)
 
-def parse_profile_html_static(html: str, url: str) -> Dict:
+def _has_class(el, name: str) -> bool:
+    cls = el.get("class")
+    return bool(cls) and name in cls.split()
+
+def _extract_stats_fast(html: str, chunk: int = 65536) -> Optional[Tuple[Dict[str, str], Optional[str]]]:
+    """Потоковый разбор через lxml: читаем только до конца .stats_inner (и первого h1).
+
+    None — блок статистики не найден или lxml недоступен; тогда работает BS4.
+    """
+    try:
+        from lxml import etree
+    except ImportError:
+        return None
+
+    parser = etree.HTMLPullParser(events=("start", "end"))
+    stats_map: Dict[str, str] = {}
+    nickname: Optional[str] = None
+    depth_inner = 0        # >0 — мы внутри .stats_inner
+    inner_done = False
+
+    for pos in range(0, len(html), chunk):
+        parser.feed(html[pos:pos + chunk])
+        for event, el in parser.read_events():
+            if not isinstance(el.tag, str):
+                continue
+            if event == "start":
+                if _has_class(el, "stats_inner") and not inner_done:
+                    depth_inner += 1
+                continue
+
+            # event == "end": поддерево элемента уже целиком разобрано
+            if el.tag == "h1" and nickname is None:
+                nickname = "".join(t.strip() for t in el.itertext())
+            elif depth_inner and _has_class(el, "stats_item"):
+                lab = val = None
+                for sub in el.iterdescendants():
+                    if not isinstance(sub.tag, str):
+                        continue
+                    if lab is None and _has_class(sub, "stats_text"):
+                        lab = sub
+                    elif val is None and _has_class(sub, "stats_value"):
+                        val = sub
+                if lab is not None and val is not None:
+                    L = _norm_label("".join(lab.itertext()))
+                    V = " ".join(t.strip() for t in val.itertext() if t.strip())
+                    stats_map[L] = V
+            elif depth_inner and _has_class(el, "stats_inner"):
+                depth_inner -= 1
+                inner_done = depth_inner == 0
+
+            if inner_done and nickname is not None:
+                return stats_map, nickname
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        pass
+    if not inner_done:
+        return None
+    return stats_map, nickname
+
+def _extract_stats_soup(html: str) -> Tuple[Dict[str, str], Optional[str]]:
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, "lxml")
 
     h1 = soup.select_one("h1")
-    if h1:
-        nickname = h1.get_text(strip=True)
-    else:
-        tail = url.strip("/").split("/")[-1]
-        nickname = tail.split("-", 1)[1] if "-" in tail else tail
+    nickname = h1.get_text(strip=True) if h1 else None
 
     stats_map: Dict[str, str] = {}
     inner = soup.select_one(".stats_inner")
@@ -249,6 +914,16 @@ def parse_profile_html_static(html: str, url: str) -> Dict:
                 L = _norm_label(lab.get_text())
                 V = val.get_text(" ", strip=True)
                 stats_map[L] = V
+    return stats_map, nickname
+
+def parse_profile_html_static(html: str, url: str) -> Dict:
+    # Быстрый путь (lxml, только блок статистики), BS4 — запасной
+    fast = _extract_stats_fast(html)
+    stats_map, nickname = fast if fast is not None else _extract_stats_soup(html)
+
+    if not nickname:
+        tail = url.strip("/").split("/")[-1]
+        nickname = tail.split("-", 1)[1] if "-" in tail else tail
 
     return _map_stats_to_data(stats_map, nickname, html)
 
@@ -279,7 +954,7 @@ def _map_stats_to_data(stats_map_raw: Dict[str, str], nickname: Optional[str], h
 
     masterCount = vehiclesCount = None
     if master_txt:
-        m = re.match(r"\s*([\d\s.,]+)\s*/\s*([\d\s.,]+)\s*$", master_txt)
+        m = _MASTER_RX.match(master_txt)
         if m:
             masterCount   = _clean_int(m.group(1))
             vehiclesCount = _clean_int(m.group(2))
@@ -354,6 +1029,60 @@ def is_good(data: Dict) -> bool:
 # ─────────────────────────────────────────────
 # Обвязка: список, сохранение
 
+def _roster_row(line: str) -> Optional[Dict]:
+    """Строка ростера → {"id", "name"}: NDJSON-объект или "id;name" (csv/txt).
+    Пустые строки, комментарии и заголовок CSV (нечисловой id) пропускаем.
+    Битая строка — ValueError."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("{"):
+        obj = json.loads(line)
+        if not isinstance(obj, dict):
+            raise ValueError("не объект")
+        acc = obj.get("id", obj.get("accountId"))
+        if acc is None:
+            return None
+        return {"id": int(acc), "name": obj.get("name") or obj.get("nickname")}
+    parts = [t.strip().strip('"') for t in re.split(r"[;,|\s]\s*", line) if t.strip()]
+    if not parts or not parts[0].isdigit():
+        return None
+    return {"id": int(parts[0]), "name": parts[1] if len(parts) > 1 and parts[1] else None}
+
+ROSTER_ERRORS_SHOWN = 5
+
+def _roster_rows(lines: Iterable[str], source: str) -> Iterable[Dict]:
+    """Строки → задания; битые строки пропускаем и считаем, а не роняем весь прогон."""
+    bad = 0
+    for lineno, line in enumerate(lines, 1):
+        try:
+            row = _roster_row(line)
+        except (ValueError, TypeError) as e:
+            bad += 1
+            if bad <= ROSTER_ERRORS_SHOWN:
+                print(f"SKIP {source}:{lineno}: {type(e).__name__}: {e}")
+            continue
+        if row:
+            yield row
+    if bad:
+        print(f"Ростер {source}: пропущено битых строк — {bad}")
+
+def iter_participants(path: pathlib.Path) -> Iterable[Dict]:
+    """Ростер построчно, не читая файл целиком: .ndjson/.jsonl/.csv/.txt или "-" (stdin).
+
+    .json — обычный массив, его приходится разбирать целиком.
+    """
+    if str(path) == "-":
+        yield from _roster_rows(sys.stdin, "stdin")
+        return
+    if not path.exists():
+        raise FileNotFoundError(path)
+    if path.suffix.lower() == ".json":
+        yield from json.loads(path.read_text(encoding="utf-8"))
+        return
+    with path.open(encoding="utf-8") as f:
+        yield from _roster_rows(f, str(path))
+
 def load_participants(path: pathlib.Path) -> Iterable[Dict]:
     p = path
     if not p.exists():
@@ -361,24 +1090,95 @@ def load_participants(path: pathlib.Path) -> Iterable[Dict]:
 
     if p.suffix.lower() == ".json":
         return json.loads(p.read_text(encoding="utf-8"))
+    return list(iter_participants(p))
 
-    items = []
-    for line in p.read_text(encoding="utf-8").splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        parts = [t.strip() for t in re.split(r"[;,|\s]\s*", line) if t.strip()]
-        if not parts:
+def dedup_jobs(jobs: Iterable[Dict]) -> List[Dict]:
+    """Дедуп списка по id: порядок первого вхождения, но пустое имя берём
+    из более позднего дубля (--id X без ника + тот же X в ростере — нужен ник для URL)."""
+    uniq: Dict[int, Dict] = {}
+    for j in jobs:
+        acc = int(j["id"])
+        cur = uniq.get(acc)
+        if cur is None:
+            uniq[acc] = {"id": acc, "name": j.get("name")}
+        elif not cur["name"] and j.get("name"):
+            cur["name"] = j["name"]
+    return list(uniq.values())
+
+def dedup_stream(jobs: Iterable[Dict], seen: Optional[set] = None) -> Iterable[Dict]:
+    """Дедуп по id на лету для --stream: в памяти только множество int-ов, не записи.
+    Побеждает первое вхождение (отданное задание уже не поправить), поэтому
+    --id без ника _main_stream ставит после ростера."""
+    seen = set() if seen is None else seen
+    for j in jobs:
+        acc = int(j["id"])
+        if acc in seen:
             continue
-        acc = int(parts[0])
-        name = parts[1] if len(parts) > 1 else None
-        items.append({"id": acc, "name": name})
-    return items
-
-def save_json(out_dir: pathlib.Path, data: Dict):
+        seen.add(acc)
+        yield {"id": acc, "name": j.get("name")}
+
+@contextmanager
+def _atomic_writer(path: pathlib.Path):
+    """temp-файл в той же папке + fsync + rename: читатель видит либо старое, либо новое."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+def _atomic_write_text(path: pathlib.Path, text: str) -> None:
+    with _atomic_writer(path) as f:
+        f.write(text)
+
+# Поля, которые меняются на каждом прогоне и сами по себе не повод переписывать файл
+VOLATILE_FIELDS = ("fetchedAt",)
+
+def _dump_json(obj, compact: bool = False) -> str:
+    """compact (--compact) — без отступов: фронтенду всё равно, git-диффы хуже."""
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+def same_stats(a: Optional[Dict], b: Optional[Dict]) -> bool:
+    """Записи равны с точностью до VOLATILE_FIELDS."""
+    if not isinstance(a, dict) or not isinstance(b, dict):
+        return False
+    return ({k: v for k, v in a.items() if k not in VOLATILE_FIELDS} ==
+            {k: v for k, v in b.items() if k not in VOLATILE_FIELDS})
+
+def stable_record(prev: Optional[Dict], data: Dict) -> Dict:
+    """Что класть в индекс: прошлую запись, если статистика не поменялась, иначе новую."""
+    return prev if same_stats(prev, data) else data
+
+def save_json(out_dir: pathlib.Path, data: Dict, compact: bool = False) -> bool:
+    """Пишет <out>/<id>.json, только если статистика отличается от лежащей на диске.
+
+    Если поменялся лишь fetchedAt — файл не трогаем (свежесть уходит в
+    freshness.json). Возвращает True, если статистика записана заново.
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
     path = out_dir / f"{data['accountId']}.json"
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    try:
+        text = path.read_text(encoding="utf-8")
+        old = json.loads(text)
+    except Exception:
+        text, old = None, None
+    if same_stats(old, data):
+        if text != _dump_json(old, compact):
+            # включили/выключили --compact: переформатируем, fetchedAt оставляем старый
+            _atomic_write_text(path, _dump_json(old, compact))
+        return False
+    _atomic_write_text(path, _dump_json(data, compact))
+    return True
 
 def load_index(out_dir: pathlib.Path) -> Dict[int, Dict]:
     idx_path = out_dir / "index.json"
@@ -391,19 +1191,903 @@ def load_index(out_dir: pathlib.Path) -> Dict[int, Dict]:
     except Exception:
         return {}
 
-def save_index(out_dir: pathlib.Path, items: List[Dict]) -> None:
+def save_index(out_dir: pathlib.Path, items: List[Dict], generated_at: Optional[str] = None,
+               compact: bool = False) -> bool:
+    """index.json; если список игроков тот же, что на диске, файл (и generatedAt) не трогаем."""
     out_dir.mkdir(parents=True, exist_ok=True)
     index_path = out_dir / "index.json"
+    old = _read_json(index_path)
+    if isinstance(old, dict) and old.get("players") == items and old.get("generatedAt"):
+        text = _dump_json({"generatedAt": old["generatedAt"], "players": items}, compact)
+        if index_path.read_text(encoding="utf-8") == text:
+            return False
+        _atomic_write_text(index_path, text)
+        return True
     payload = {
-        "generatedAt": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+        "generatedAt": generated_at or datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
         "players": items,
     }
-    index_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    _atomic_write_text(index_path, _dump_json(payload, compact))
+    return True
+
+FRESHNESS_FILE = "freshness.json"
+
+def save_freshness(out_dir: pathlib.Path, stamps: Dict[int, str]) -> None:
+    """freshness.json: accountId → когда статистику последний раз подтверждали.
+
+    Единственный файл, который меняется на каждом прогоне, поэтому маленький и
+    всегда компактный. Новые отметки сливаются с уже записанными.
+    """
+    if not stamps:
+        return
+    path = out_dir / FRESHNESS_FILE
+    old = _read_json(path)
+    merged = {int(k): v for k, v in ((old or {}).get("players") or {}).items()} if isinstance(old, dict) else {}
+    for acc, ts in stamps.items():
+        if ts and ts >= (merged.get(int(acc)) or ""):
+            merged[int(acc)] = ts
+    payload = {"checkedAt": max(merged.values()),
+               "players": {str(k): merged[k] for k in sorted(merged)}}
+    _atomic_write_text(path, json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+
+def checked_stamps(traces: List[Dict]) -> Dict[int, str]:
+    """accountId → checkedAt для UNCHANGED: страница та же, но проверена сейчас."""
+    return {t["accountId"]: t["checkedAt"] for t in traces if t.get("checkedAt")}
+
+class PlayerFiles:
+    """prev_map без загрузки index.json: запись игрока читается из <out>/<id>.json по запросу.
+
+    Файлы игроков и так пишутся только для хороших данных, поэтому именно они —
+    источник правды для потокового индекса.
+    """
+
+    def __init__(self, out_dir: pathlib.Path):
+        self.out_dir = out_dir
+
+    def get(self, account_id: int, default=None) -> Optional[Dict]:
+        data = _read_json(self.out_dir / f"{account_id}.json")
+        return data if isinstance(data, dict) else default
+
+    def ids(self) -> List[int]:
+        if not self.out_dir.exists():
+            return []
+        return sorted(int(p.stem) for p in self.out_dir.glob("*.json") if p.stem.isdigit())
+
+def _players_section_sha1(path: pathlib.Path) -> Optional[str]:
+    """sha1 index.json начиная с ключа "players" — всё, кроме generatedAt."""
+    h = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            head = f.read(256)
+            i = head.find(b'"players"')
+            if i < 0:
+                return None
+            h.update(head[i:])
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def save_index_streaming(out_dir: pathlib.Path, generated_at: Optional[str] = None,
+                         compact: bool = False) -> int:
+    """index.json из файлов игроков по одному: в памяти — только список id.
+    Формат байт-в-байт как у save_index; если игроки те же, старый файл остаётся.
+    Возвращает число игроков."""
+    files = PlayerFiles(out_dir)
+    index_path = out_dir / "index.json"
+    stamp = generated_at or datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+    if compact:
+        head, item_sep, tail, empty_tail = '{"generatedAt":' + json.dumps(stamp) + ',"players":[', "", "]}", "]}"
+    else:
+        head, item_sep, tail, empty_tail = ('{\n  "generatedAt": ' + json.dumps(stamp) + ',\n  "players": [',
+                                            "\n    ", "\n  ]\n}", "]\n}")
+    split = head.index('"players"')
+    body_sha = hashlib.sha1()  # всё после generatedAt — сравниваем со старым индексом
+    n = 0
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".index.json.", suffix=".tmp", dir=str(out_dir))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            def _put(text: str) -> None:
+                f.write(text)
+                body_sha.update(text.encode("utf-8"))
+            f.write(head[:split])
+            _put(head[split:])
+            for acc in files.ids():
+                rec = files.get(acc)
+                if rec is None or not is_good(rec):
+                    continue
+                body = _dump_json(rec, True) if compact else _dump_json(rec).replace("\n", "\n    ")
+                _put(("," if n else "") + item_sep + body)
+                n += 1
+            _put(tail if n else empty_tail)
+            f.flush()
+            os.fsync(f.fileno())
+        if _players_section_sha1(index_path) == body_sha.hexdigest():
+            os.unlink(tmp)
+        else:
+            os.replace(tmp, index_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return n
+
+# ─────────────────────────────────────────────
+# Бандл для фронтенда: index + teams + playoff одним файлом
+
+BUNDLE_MANIFEST = "bundle-manifest.json"
+
+def _read_json(path: pathlib.Path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+def _avg(values: List) -> Optional[float]:
+    vals = [v for v in values if isinstance(v, (int, float))]
+    return round(sum(vals) / len(vals), 2) if vals else None
+
+def _team_aggregates(team: Dict, by_nick: Dict[str, Dict]) -> Dict:
+    members = [by_nick.get(str(n).strip().lower()) for n in team.get("players", [])]
+    found = [m for m in members if m]
+    out = dict(team)
+    out["accountIds"] = [m["accountId"] if m else None for m in members]
+    out["avg"] = {
+        "global_rating": _avg([m.get("global_rating") for m in found]),
+        "winRate": _avg([m.get("winRate") for m in found]),
+        "avgDmg": _avg([m.get("avgDmg") for m in found]),
+    }
+    out["battles"] = sum(m.get("battles") or 0 for m in found)
+    return out
+
+def build_bundle(players: List[Dict], data_dir: pathlib.Path,
+                 aliases: Optional[Dict[str, int]] = None) -> Dict:
+    """Собирает бандл: игроки, команды с агрегатами, плей-офф и рейтинги.
+
+    aliases — ник из participants → accountId (в index ник бывает кривым).
+    Меток времени прогона в бандле нет: хэш меняется только вместе с данными.
+    """
+    by_id = {int(p["accountId"]): p for p in players if "accountId" in p}
+    by_nick: Dict[str, Dict] = {}
+    for p in players:
+        if p.get("nickname"):
+            by_nick[str(p["nickname"]).strip().lower()] = p
+    for name, acc in (aliases or {}).items():
+        if name and acc in by_id:
+            by_nick.setdefault(str(name).strip().lower(), by_id[acc])
+
+    teams_raw = (_read_json(data_dir / "teams.json") or {}).get("teams", [])
+    playoff = _read_json(data_dir / "playoff12.json") or {}
+    teams = [_team_aggregates(t, by_nick) for t in teams_raw]
+
+    def _key(t):
+        r = t["avg"]["global_rating"]
+        return (r is None, -(r or 0), t.get("name") or "")
+    for rank, t in enumerate(sorted(teams, key=_key), 1):
+        t["rank"] = rank
+
+    ranked_players = sorted(by_id.values(), key=lambda p: (-(p.get("global_rating") or 0), p["accountId"]))
+    return {
+        "version": 1,
+        "players": [by_id[k] for k in sorted(by_id)],
+        "teams": teams,
+        "playoff": playoff,
+        "rankings": {
+            "teams": [t.get("name") for t in sorted(teams, key=_key)],
+            "players": [p["accountId"] for p in ranked_players],
+        },
+    }
+
+def save_bundle(out_dir: pathlib.Path, bundle: Dict, keep: int = 2) -> str:
+    """Пишет bundle.<hash>.json и манифест; старые бандлы (кроме keep последних) удаляет.
+
+    Возвращает имя файла бандла.
+    """
+    text = json.dumps(bundle, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    name = f"bundle.{digest}.json"
+    path = out_dir / name
+    if not path.exists():
+        _atomic_write_text(path, text)
+
+    manifest_path = out_dir / BUNDLE_MANIFEST
+    manifest = _read_json(manifest_path) or {}
+    if manifest.get("file") != name:
+        history = [name] + [f for f in manifest.get("previous", []) if f != name]
+        _atomic_write_text(manifest_path, json.dumps(
+            {"file": name, "hash": digest, "previous": history[1:keep]},
+            ensure_ascii=False, indent=2,
+        ))
+        alive = set(history[:keep])
+        for old in out_dir.glob("bundle.*.json"):
+            if old.name not in alive:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+    return name
+
+# ─────────────────────────────────────────────
+# Свежесть: TTL + условные запросы + хэш сырой страницы
+
+def _parse_duration(s) -> float:
+    """'90' / '90s' / '45m' / '3h' / '1d' → секунды."""
+    if s is None or s == "":
+        return 0.0
+    if isinstance(s, (int, float)):
+        return float(s)
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", str(s).lower())
+    if not m:
+        raise ValueError(f"bad duration: {s!r}")
+    mult = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[m.group(2)]
+    return float(m.group(1)) * mult
+
+def _parse_iso(s: Optional[str]) -> Optional[datetime]:
+    if not s:
+        return None
+    try:
+        return datetime.fromisoformat(str(s).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+class FreshnessCache:
+    """accountId → валидаторы последней удачной статической страницы.
+
+    Хранится в <out>/.fetch_cache.json: etag, lastModified, sha1 сырого HTML,
+    тир, которым данные были получены, и checkedAt — когда профиль
+    последний раз проверяли (даже если файл статистики не переписывался).
+    """
+
+    FILE = ".fetch_cache.json"
+
+    def __init__(self, out_dir: pathlib.Path, max_age: float = 0.0):
+        self.path = out_dir / self.FILE
+        self.max_age = max_age
+        self.entries: Dict[int, Dict] = {}
+        self.dirty = False
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+            self.entries = {int(k): v for k, v in raw.get("accounts", {}).items()}
+        except Exception:
+            self.entries = {}
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"accounts": {str(k): self.entries[k] for k in sorted(self.entries)}}
+        _atomic_write_text(self.path, json.dumps(payload, ensure_ascii=False, indent=1))
+        self.dirty = False
+
+    def is_fresh(self, account_id: int, prev: Optional[Dict]) -> bool:
+        """Свежий = есть хорошая прошлая запись и проверяли её не раньше max_age назад."""
+        if self.max_age <= 0 or not prev or not is_good(prev):
+            return False
+        entry = self.entries.get(account_id) or {}
+        stamps = [t for t in (_parse_iso(prev.get("fetchedAt")), _parse_iso(entry.get("checkedAt"))) if t]
+        if not stamps:
+            return False
+        age = (datetime.now(timezone.utc) - max(stamps)).total_seconds()
+        return age < self.max_age
+
+    def conditional_headers(self, account_id: int) -> Dict[str, str]:
+        # Статическая страница говорит что-то о данных, только если они из неё и пришли
+        entry = self.entries.get(account_id) or {}
+        if entry.get("tier") != "static":
+            return {}
+        h = {}
+        if entry.get("etag"):
+            h["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified"):
+            h["If-Modified-Since"] = entry["lastModified"]
+        return h
+
+    def is_unchanged(self, account_id: int, resp, sha1: str) -> bool:
+        entry = self.entries.get(account_id) or {}
+        if entry.get("tier") != "static":
+            return False
+        return resp.status_code == 304 or entry.get("sha1") == sha1
+
+    def remember(self, account_id: int, resp, sha1: Optional[str], tier: str) -> None:
+        entry = {"checkedAt": _now_iso(), "tier": tier, "sha1": sha1}
+        if resp is not None:
+            if resp.headers.get("ETag"):
+                entry["etag"] = resp.headers["ETag"]
+            if resp.headers.get("Last-Modified"):
+                entry["lastModified"] = resp.headers["Last-Modified"]
+        self.entries[account_id] = entry
+        self.dirty = True
+
+    def touch(self, account_id: int, tier: Optional[str] = None) -> None:
+        entry = self.entries.setdefault(account_id, {})
+        entry["checkedAt"] = _now_iso()
+        if tier:
+            entry["tier"] = tier
+        self.dirty = True
+
+# ─────────────────────────────────────────────
+# Архив сырья: HTML, DOM stats_map и текст Jina (gzip, адресация по sha256)
+
+class PageArchive:
+    """Всё, что скачали, — в <out>/.archive, чтобы перепарсить без сети (reparse).
+
+    objects/<sha[:2]>/<sha>.gz — сжатое содержимое, одинаковые страницы
+    хранятся один раз. refs.ndjson — строка на каждый результат scrape_one:
+    accountId, fetchedAt записи, тир и список захватов (kind + sha).
+    """
+
+    DIR = ".archive"
+    REFS = "refs.ndjson"
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.objects = root / "objects"
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(raw: bytes) -> str:
+        return hashlib.sha256(raw).hexdigest()
+
+    def _path(self, sha: str) -> pathlib.Path:
+        return self.objects / sha[:2] / f"{sha}.gz"
+
+    def put(self, kind: str, text: str, **meta) -> Dict:
+        raw = text.encode("utf-8")
+        sha = self.digest(raw)
+        path = self._path(sha)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(gzip.compress(raw, compresslevel=6, mtime=0))
+            os.replace(tmp, path)
+        return {"kind": kind, "sha": sha, **meta}
+
+    async def put_async(self, kind: str, text: str, **meta) -> Dict:
+        # сжатие страницы в сотни КБ — не в event loop
+        return await asyncio.to_thread(self.put, kind, text, **meta)
+
+    def get(self, sha: str) -> Optional[str]:
+        try:
+            return gzip.decompress(self._path(sha).read_bytes()).decode("utf-8")
+        except (OSError, EOFError):
+            return None
+
+    def record(self, account_id: int, fetched_at: str, url: str, nickname: Optional[str],
+               tier: Optional[str], captures: List[Dict]) -> None:
+        line = json.dumps({"accountId": account_id, "fetchedAt": fetched_at, "url": url,
+                           "nickname": nickname, "tier": tier, "captures": captures},
+                          ensure_ascii=False)
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with (self.root / self.REFS).open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def latest_refs(self) -> Dict[int, Dict]:
+        """accountId → последняя строка refs.ndjson (битые строки пропускаем)."""
+        out: Dict[int, Dict] = {}
+        path = self.root / self.REFS
+        if not path.exists():
+            return out
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ref = json.loads(line)
+                    acc = int(ref["accountId"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if acc not in out or (ref.get("fetchedAt") or "") >= (out[acc].get("fetchedAt") or ""):
+                    out[acc] = ref
+        return out
+
+    def prune(self, max_age: float) -> Tuple[int, int]:
+        """Срезать архив: строки refs.ndjson старше max_age секунд (кроме последней
+        по аккаунту — без неё reparse не соберёт запись) и объекты, на которые
+        больше никто не ссылается. Возвращает (удалено ссылок, удалено объектов)."""
+        path = self.root / self.REFS
+        if max_age <= 0 or not path.exists():
+            return 0, 0
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=max_age)).isoformat(
+            timespec="seconds").replace("+00:00", "Z")
+        latest = {acc: ref.get("fetchedAt") or "" for acc, ref in self.latest_refs().items()}
+        live: set = set()
+        dropped = 0
+        with self._lock:
+            with path.open(encoding="utf-8") as src, _atomic_writer(path) as dst:
+                for line in src:
+                    try:
+                        ref = json.loads(line)
+                        acc = int(ref["accountId"])
+                    except (ValueError, KeyError, TypeError):
+                        dropped += 1
+                        continue
+                    fetched = ref.get("fetchedAt") or ""
+                    if fetched < cutoff and fetched != latest.get(acc):
+                        dropped += 1
+                        continue
+                    live.update(c.get("sha") for c in ref.get("captures") or [])
+                    dst.write(line if line.endswith("\n") else line + "\n")
+            removed = 0
+            for obj in self.objects.glob("*/*.gz"):
+                if obj.name[:-3] not in live:
+                    try:
+                        obj.unlink()
+                        removed += 1
+                    except OSError:
+                        pass
+        return dropped, removed
+
+# serve чистит архив не каждый цикл, а раз в сутки: обход objects/ — не бесплатный
+ARCHIVE_PRUNE_EVERY = 86400.0
+
+def prune_archive(archive: PageArchive, max_age: float) -> None:
+    refs, objects = archive.prune(max_age)
+    if refs or objects:
+        print(f"Архив: удалено старых ссылок {refs}, объектов {objects}")
+
+def reparse_ref(root: str, ref: Dict) -> Tuple[int, Optional[Dict]]:
+    """Запись игрока из архивных захватов, без сети. Сначала тир, который дал
+    данные в тот раз, потом остальные. Функция верхнего уровня — для ProcessPool."""
+    archive = PageArchive(pathlib.Path(root))
+    acc = int(ref["accountId"])
+    caps = sorted(ref.get("captures") or [], key=lambda c: c.get("kind") != {
+        "static": "html", "render": "dom", "jina": "jina"}.get(ref.get("tier") or "", ""))
+    nick = ref.get("nickname")
+    for cap in caps:
+        text = archive.get(cap["sha"])
+        if text is None:
+            continue
+        if cap["kind"] == "html":
+            res = parse_profile_html_static(text, ref.get("url") or build_profile_url(acc, nick))
+        elif cap["kind"] == "dom":
+            res = _map_stats_to_data(json.loads(text), cap.get("nickname") or nick, None)
+        else:
+            res = _map_stats_to_data({}, nick, text)
+        if res is not None and not seems_invalid(res):
+            data = {"accountId": acc, "nickname": nick, "battles": 0, "wins": None, "winRate": 0.0,
+                    "avgDmg": 0, "avgFrags": None, "surviveRate": None, "hitsPercents": None,
+                    "global_rating": 0}
+            data.update(res)
+            data["fetchedAt"] = ref["fetchedAt"]
+            return acc, data
+    return acc, None
+
+# ─────────────────────────────────────────────
+# История: append-only снапшоты в SQLite
+
+HISTORY_FIELDS = (
+    "battles", "wins", "winRate", "avgDmg", "hitsPercents", "global_rating",
+    "avgExp", "maxExp", "maxFrags", "masterCount", "vehiclesCount",
+)
+
+class HistoryStore:
+    """Все удачные результаты scrape_one по (accountId, fetchedAt).
+
+    Ничего не переписываем: повтор того же (accountId, fetchedAt) игнорируется.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        cols = ", ".join(f"{f} {'REAL' if f in ('winRate', 'hitsPercents') else 'INTEGER'}"
+                         for f in HISTORY_FIELDS)
+        self.db.execute(f"""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                accountId INTEGER NOT NULL,
+                fetchedAt TEXT NOT NULL,
+                nickname TEXT,
+                {cols},
+                PRIMARY KEY (accountId, fetchedAt)
+            ) WITHOUT ROWID
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS snapshots_fetched ON snapshots (fetchedAt)")
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def append(self, data: Dict) -> None:
+        if not data.get("fetchedAt") or "accountId" not in data:
+            return
+        names = ("accountId", "fetchedAt", "nickname") + HISTORY_FIELDS
+        self.db.execute(
+            f"INSERT OR IGNORE INTO snapshots ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            [data.get(n) for n in names],
+        )
+        self.db.commit()
+
+    def append_many(self, items: List[Dict]) -> None:
+        """Пачкой, одним коммитом (для BatchWriter)."""
+        names = ("accountId", "fetchedAt", "nickname") + HISTORY_FIELDS
+        rows = [[d.get(n) for n in names] for d in items if d.get("fetchedAt") and "accountId" in d]
+        if not rows:
+            return
+        self.db.executemany(
+            f"INSERT OR IGNORE INTO snapshots ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            rows,
+        )
+        self.db.commit()
+
+    @staticmethod
+    def _row(r) -> Dict:
+        return dict(r) if r is not None else None
+
+    def latest(self, account_id: Optional[int] = None) -> List[Dict]:
+        """Последний снапшот по аккаунту (или по всем аккаунтам)."""
+        q = """
+            SELECT s.* FROM snapshots s
+            JOIN (SELECT accountId, MAX(fetchedAt) AS t FROM snapshots
+                  {where} GROUP BY accountId) m
+              ON s.accountId = m.accountId AND s.fetchedAt = m.t
+            ORDER BY s.accountId
+        """
+        if account_id is None:
+            rows = self.db.execute(q.format(where=""))
+        else:
+            rows = self.db.execute(q.format(where="WHERE accountId = ?"), (account_id,))
+        return [dict(r) for r in rows]
+
+    def range(self, account_id: int, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """Снапшоты аккаунта в [since, until] по возрастанию fetchedAt."""
+        rows = self.db.execute(
+            "SELECT * FROM snapshots WHERE accountId = ? AND fetchedAt >= ? AND fetchedAt <= ? "
+            "ORDER BY fetchedAt",
+            (account_id, since or "", until or "9999"),
+        )
+        return [dict(r) for r in rows]
+
+    def baseline(self, account_id: int, since: str) -> Optional[Dict]:
+        """Последний снапшот не позже since; если до since ничего нет — первый после."""
+        r = self.db.execute(
+            "SELECT * FROM snapshots WHERE accountId = ? AND fetchedAt <= ? ORDER BY fetchedAt DESC LIMIT 1",
+            (account_id, since),
+        ).fetchone()
+        if r is None:
+            r = self.db.execute(
+                "SELECT * FROM snapshots WHERE accountId = ? AND fetchedAt > ? ORDER BY fetchedAt LIMIT 1",
+                (account_id, since),
+            ).fetchone()
+        return self._row(r)
+
+    def deltas(self, since: str) -> List[Dict]:
+        """Изменения числовых полей: последний снапшот минус базовый на момент since."""
+        out = []
+        for cur in self.latest():
+            base = self.baseline(cur["accountId"], since)
+            if base is None:
+                continue
+            delta = {}
+            for f in HISTORY_FIELDS:
+                a, b = base.get(f), cur.get(f)
+                if a is not None and b is not None:
+                    d = b - a
+                    delta[f] = round(d, 2) if isinstance(d, float) else d
+            out.append({
+                "accountId": cur["accountId"],
+                "nickname": cur.get("nickname"),
+                "from": base["fetchedAt"],
+                "to": cur["fetchedAt"],
+                "delta": delta,
+            })
+        return out
+
+# ─────────────────────────────────────────────
+# Журнал прогона: чекпоинты и --resume
+
+class RunJournal:
+    """Append-only журнал прогона в <out>/.journal.ndjson.
+
+    Строка на каждый обработанный аккаунт (для OK — с данными), fsync после
+    каждой. Удачный прогон журнал удаляет; если процесс упал, --resume
+    пропускает уже обработанные аккаунты и достраивает index.json из журнала.
+    """
+
+    FILE = ".journal.ndjson"
+
+    def __init__(self, out_dir: pathlib.Path, suffix: str = ""):
+        self.path = out_dir / (self.FILE.replace(".ndjson", f"{suffix}.ndjson") if suffix else self.FILE)
+        self._fh = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> Tuple[set, Dict[int, Dict]]:
+        """→ (id всех обработанных аккаунтов, {id: data} удачных)."""
+        done: set = set()
+        updated: Dict[int, Dict] = {}
+        if not self.path.exists():
+            return done, updated
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # хвост, недописанный при падении
+                    continue
+                if "id" not in rec:
+                    continue
+                acc = int(rec["id"])
+                done.add(acc)
+                if rec.get("status") == "OK" and rec.get("data"):
+                    updated[acc] = rec["data"]
+        return done, updated
+
+    def open(self, resume: bool = False) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = self.path.open("a" if resume else "w", encoding="utf-8")
+        if not resume:
+            self._write({"run": _now_iso()})
+
+    def _write(self, rec: Dict) -> None:
+        self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def record(self, account_id: int, status: str, data: Optional[Dict] = None) -> None:
+        if self._fh is None:
+            return
+        rec: Dict = {"id": account_id, "status": status}
+        if data is not None:
+            rec["data"] = data
+        self._write(rec)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def finish(self) -> None:
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+# ─────────────────────────────────────────────
+# Лимиты параллелизма по хостам
+
+class HostLimits:
+    """Не больше per_host одновременных запросов к одному домену."""
+
+    def __init__(self, per_host: int = 1):
+        self.per_host = max(1, int(per_host))
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+
+    def slot(self, url: str) -> asyncio.Semaphore:
+        host = (urlparse(url).hostname or "").lower()
+        sem = self._sems.get(host)
+        if sem is None:
+            sem = self._sems[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+# ─────────────────────────────────────────────
+# Маршрутизация по тирам + circuit breaker
+
+TIERS = ("static", "render", "jina")  # от дешёвого к дорогому
+
+class TierRouter:
+    """Помнит, какой тир сейчас работает, и с него начинает новые аккаунты.
+
+    ok — EWMA доли удачных ответов тира, latency — EWMA времени.
+    Тир с ok < 0.5 пропускаем (кроме каждой probe_every-й попытки — проба
+    дешёвого тира; одна удачная проба возвращает его в строй).
+    После fail_threshold провалов подряд тир выключается на cooldown секунд;
+    по истечении — одна попытка, и при провале снова выключаем.
+    disable() убирает тир до конца прогона (preflight: нет Chromium, хост недоступен).
+    """
+
+    def __init__(self, tiers: Iterable[str] = TIERS, fail_threshold: int = 5,
+                 cooldown: float = 300.0, probe_every: int = 20, alpha: float = 0.2):
+        self.tiers = tuple(tiers)
+        self.fail_threshold = fail_threshold
+        self.cooldown = cooldown
+        self.probe_every = max(1, probe_every)
+        self.alpha = alpha
+        self.state: Dict[str, Dict] = {
+            t: {"ok": 1.0, "latency": 0.0, "fails": 0, "openUntil": 0.0, "n": 0} for t in self.tiers
+        }
+        self.disabled: Dict[str, str] = {}
+        self._plans = 0
+
+    def disable(self, tier: str, reason: str) -> None:
+        if tier in self.state and len(self.disabled) < len(self.tiers) - 1:
+            # последний рабочий тир не выключаем: пусть лучше падает с понятной ошибкой
+            self.disabled[tier] = reason
+
+    def is_open(self, tier: str, now: Optional[float] = None) -> bool:
+        return self.state[tier]["openUntil"] > (now if now is not None else time.time())
+
+    def plan(self) -> List[str]:
+        now = time.time()
+        self._plans += 1
+        tiers = [t for t in self.tiers if t not in self.disabled]
+        avail = [t for t in tiers if not self.is_open(t, now)]
+        if not avail:
+            # все выключены — пробуем по порядку, лучше чем не пробовать вовсе
+            return tiers
+        healthy = [t for t in avail if self.state[t]["ok"] >= 0.5]
+        start = avail.index(healthy[0]) if healthy else 0
+        if start and self._plans % self.probe_every == 0:
+            # изредка проверяем, не ожил ли дешёвый тир
+            return avail
+        # дешёвые "больные" тиры — последним шансом
+        return avail[start:] + avail[:start]
+
+    def report(self, tier: str, ok: bool, seconds: float) -> None:
+        st = self.state.get(tier)
+        if st is None:
+            return
+        a = self.alpha
+        st["n"] += 1
+        st["latency"] = seconds if st["n"] == 1 else (1 - a) * st["latency"] + a * seconds
+        st["ok"] = (1 - a) * st["ok"] + a * (1.0 if ok else 0.0)
+        if ok:
+            st["fails"] = 0
+            st["ok"] = max(st["ok"], 0.5)
+        else:
+            st["fails"] += 1
+            if st["fails"] >= self.fail_threshold:
+                st["openUntil"] = time.time() + self.cooldown
+
+    def summary(self) -> str:
+        parts = []
+        for t in self.tiers:
+            if t in self.disabled:
+                parts.append(f"{t}: off ({self.disabled[t]})")
+                continue
+            st = self.state[t]
+            flag = " OPEN" if self.is_open(t) else ""
+            parts.append(f"{t}: ok={st['ok']:.2f} lat={st['latency']:.2f}s n={st['n']}{flag}")
+        return "; ".join(parts)
+
+    def load(self, path: pathlib.Path) -> None:
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        for t, st in raw.get("tiers", {}).items():
+            if t in self.state:
+                self.state[t].update({k: st[k] for k in ("ok", "latency", "fails", "openUntil") if k in st})
+
+    def save(self, path: pathlib.Path) -> None:
+        payload = {"savedAt": _now_iso(), "tiers": self.state}
+        _atomic_write_text(path, json.dumps(payload, ensure_ascii=False, indent=1))
+
+# ─────────────────────────────────────────────
+# Предполётная проверка: браузер, сеть, папка вывода
+
+PREFLIGHT_TIMEOUT = 5.0
+
+def _chromium_install() -> Tuple[bool, str]:
+    """Есть ли Playwright и скачанный им Chromium — без запуска драйвера и браузера."""
+    import importlib.util
+    spec = importlib.util.find_spec("playwright")
+    if spec is None:
+        return False, "пакет playwright не установлен"
+    env = os.environ.get("PLAYWRIGHT_BROWSERS_PATH")
+    if env == "0":
+        roots = [pathlib.Path(spec.origin).parent / "driver" / "package" / ".local-browsers"]
+    elif env:
+        roots = [pathlib.Path(env)]
+    else:
+        roots = [pathlib.Path.home() / ".cache" / "ms-playwright",
+                 pathlib.Path.home() / "Library" / "Caches" / "ms-playwright"]
+        if os.environ.get("LOCALAPPDATA"):
+            roots.append(pathlib.Path(os.environ["LOCALAPPDATA"]) / "ms-playwright")
+    for root in roots:
+        found = sorted(root.glob("chromium*-*")) if root.is_dir() else []
+        if found:
+            return True, str(found[-1])
+    return False, "Chromium не скачан (python -m playwright install chromium)"
+
+def _out_writable(out_dir: pathlib.Path) -> Tuple[bool, str]:
+    import shutil
+    try:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".check.", dir=str(out_dir))
+        os.close(fd)
+        os.unlink(tmp)
+        free = shutil.disk_usage(out_dir).free
+    except OSError as e:
+        return False, f"{out_dir}: {e.strerror or e}"
+    return True, f"{out_dir} (свободно {free / 2 ** 30:.1f} ГиБ)"
+
+def _reachable(url: str, session=None, timeout: float = PREFLIGHT_TIMEOUT) -> Tuple[bool, str]:
+    """Хост отвечает и не режет нас (403/429/5xx — считаем недоступным)."""
+    t0 = time.monotonic()
+    try:
+        r = (session or Session()).get(url, headers=HEADERS, timeout=timeout, stream=True)
+        r.close()
+    except Exception as e:
+        return False, f"{url}: {type(e).__name__}"
+    ok = r.status_code < 500 and r.status_code not in (403, 429)
+    return ok, f"{url} → {r.status_code} ({time.monotonic() - t0:.2f} с)"
+
+def preflight(out_dir: pathlib.Path, render: bool = True, network: bool = True,
+              app_id: Optional[str] = None, session=None) -> Dict[str, Tuple[bool, str]]:
+    """Один быстрый шаг перед прогоном: {проверка: (ok, подробности)}.
+
+    out — папка вывода пишется; render — есть Playwright с Chromium;
+    с network=True ещё static/jina/api — хосты тиров отвечают (параллельно,
+    не дольше PREFLIGHT_TIMEOUT). Браузер и сеть не трогаем, если тир не нужен.
+    """
+    checks: Dict[str, Tuple[bool, str]] = {"out": _out_writable(out_dir)}
+    if render:
+        checks["render"] = _chromium_install()
+    if network:
+        from concurrent.futures import ThreadPoolExecutor
+
+        def _root(url: str) -> str:
+            u = urlparse(url)
+            return f"{u.scheme}://{u.netloc}/"
+
+        targets = {"static": _root(BASE), "jina": _root(JINA)}
+        if app_id:
+            targets["api"] = _root(API)
+        with ThreadPoolExecutor(len(targets)) as ex:
+            futs = {k: ex.submit(_reachable, u, session) for k, u in targets.items()}
+            for k, f in futs.items():
+                checks[k] = f.result()
+    return checks
+
+def apply_preflight(router: TierRouter, checks: Dict[str, Tuple[bool, str]], verbose: bool = True) -> List[str]:
+    """Выключает в router тиры, не прошедшие проверку, — до первого аккаунта,
+    а не провалом на каждом. Возвращает их имена."""
+    off = []
+    for tier in router.tiers:
+        ok, detail = checks.get(tier, (True, ""))
+        if not ok:
+            router.disable(tier, detail)
+            if tier in router.disabled:
+                off.append(tier)
+                if verbose:
+                    print(f"Тир {tier} выключен: {detail}")
+    return off
+
+def print_preflight(checks: Dict[str, Tuple[bool, str]]) -> None:
+    for name, (ok, detail) in checks.items():
+        print(f"  {name:<7} {'OK ' if ok else 'НЕТ'}  {detail}")
 
 # ─────────────────────────────────────────────
 # Основной пайп одного профиля
 
-def scrape_one(account_id: int, nickname: Optional[str] = None, session=None) -> Dict:
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+async def scrape_one_async(account_id: int, nickname: Optional[str] = None, session=None,
+                           limits: Optional[HostLimits] = None,
+                           pool: Optional[BrowserPool] = None,
+                           cache: Optional[FreshnessCache] = None,
+                           conditional: bool = False,
+                           render: bool = True,
+                           trace: Optional[Dict] = None,
+                           router: Optional["TierRouter"] = None,
+                           limiter: Optional[HostRateLimiter] = None,
+                           archive: Optional[PageArchive] = None,
+                           parser: Optional["ParserPool"] = None,
+                           capture: bool = False) -> Dict:
+    """Статика → Playwright → Jina для одного аккаунта.
+
+    Порядок тиров берём у router (по умолчанию — от дешёвого к дорогому),
+    темп запросов ко всем тирам — у limiter.
+    conditional=True (есть хорошая прошлая запись) разрешает вернуть
+    {"notModified": True}, если страница не изменилась с прошлого раза:
+    тогда ни парсинга, ни записи на диск.
+    render=False выключает Playwright-тир. В trace (если передан)
+    кладём план и тир, которым получены данные. archive — куда складывать
+    всё скачанное (HTML, DOM stats_map, текст Jina) для offline reparse.
+    parser — ParserPool: разбор HTML уходит из event loop в пул.
+    capture — режим перехвата для рендера без pool (у пула он свой, BrowserPool.capture).
+    """
+    trace = trace if trace is not None else {}
+    limits = limits or HostLimits()
+    router = router or TierRouter()
+    limiter = limiter or HostRateLimiter()
     url = build_profile_url(account_id, nickname)
     data: Dict = {
         "accountId": account_id,
@@ -412,50 +2096,1825 @@ def scrape_one(account_id: int, nickname: Optional[str] = None, session=None) ->
         "avgDmg": 0, "avgFrags": None, "surviveRate": None,
         "hitsPercents": None, "global_rating": 0,
     }
-    try:
-        # 1) Статика
-        html = fetch_html(url, session=session)
-        parsed = parse_profile_html_static(html, url)
-
-        # 2) DOM через Playwright — только если пусто
-        if seems_invalid(parsed):
-            stats_map, dom_nickname = fetch_stats_rendered(url)
-            if stats_map:
-                parsed2 = _map_stats_to_data(stats_map, dom_nickname or parsed.get("nickname"), None)
-                if not seems_invalid(parsed2):
-                    parsed = parsed2
-
-        # 3) Jina text fallback — если всё ещё пусто
-        if seems_invalid(parsed):
-            txt = fetch_via_jina_text(url)
-            if txt:
-                parsed3 = _map_stats_to_data({}, parsed.get("nickname"), txt)
-                if not seems_invalid(parsed3):
-                    parsed = parsed3
+    plan = [t for t in router.plan() if render or t != "render"]
+    trace["plan"] = plan
+    trace["tier"] = None
+
+    parsed: Optional[Dict] = None
+    nick = nickname
+    resp = sha1 = None
+    errors: List[str] = []
+    captures: List[Dict] = []
+    for tier in plan:
+        t0 = time.monotonic()
+        res: Optional[Dict] = None
+        try:
+            if tier == "static":
+                # requests блокирующий — уводим в поток
+                extra = cache.conditional_headers(account_id) if (cache and conditional) else None
+                async with limits.slot(url):
+                    with _phase(trace, "fetch"):
+                        resp = await fetch_page_async(url, session, limiter, extra, trace)
+                sha1 = hashlib.sha1(resp.content).hexdigest() if resp.status_code != 304 else None
+                if archive is not None and resp.status_code != 304:
+                    with _phase(trace, "archive"):
+                        captures.append(await archive.put_async("html", resp.text))
+                if cache and conditional and cache.is_unchanged(account_id, resp, sha1):
+                    router.report(tier, True, time.monotonic() - t0)
+                    cache.touch(account_id)
+                    trace["tier"] = "static"
+                    return {"accountId": account_id, "notModified": True}
+                with _phase(trace, "parse"):
+                    try:
+                        if parser is not None:
+                            res = await parser.parse(resp.text, url)
+                        else:
+                            res = parse_profile_html_static(resp.text, url)
+                    except Exception as e:
+                        # сломался разбор, а не тир: страница скачана, брейкер static не трогаем
+                        _count(trace, "parseErrors")
+                        errors.append(f"parse: {type(e).__name__}: {e}")
+                        continue
+                nick = res.get("nickname") or nick
+
+            elif tier == "render":
+                # DOM через Playwright
+                async with limits.slot(url):
+                    await limiter.acquire(url)
+                    _count(trace, "requests")
+                    t_render = time.monotonic()
+                    try:
+                        with _phase(trace, "render"):
+                            if pool is not None:
+                                stats_map, dom_nickname = await pool.render(url, trace, account_id)
+                            else:
+                                stats_map, dom_nickname = await _render_and_grab_dom_async(url, trace, account_id, capture)
+                    except Exception as e:
+                        limiter.feedback(url, trace.pop("renderStatus", None), time.monotonic() - t_render)
+                        raise RuntimeError(f"Playwright DOM scrape failed: {e}")
+                    limiter.feedback(url, trace.pop("renderStatus", 200), time.monotonic() - t_render)
+                if stats_map and archive is not None:
+                    with _phase(trace, "archive"):
+                        captures.append(await archive.put_async(
+                            "dom", json.dumps(stats_map, ensure_ascii=False, sort_keys=True),
+                            nickname=dom_nickname))
+                if stats_map:
+                    with _phase(trace, "map"):
+                        res = _map_stats_to_data(stats_map, dom_nickname or nick, None)
 
+            else:
+                # Jina text fallback
+                async with limits.slot(JINA):
+                    _count(trace, "requests")
+                    with _phase(trace, "jina"):
+                        txt = await fetch_via_jina_text_async(url, limiter)
+                if txt:
+                    _count(trace, "bytes", len(txt.encode("utf-8")))
+                    if archive is not None:
+                        with _phase(trace, "archive"):
+                            captures.append(await archive.put_async("jina", txt))
+                    with _phase(trace, "map"):
+                        res = _map_stats_to_data({}, nick, txt)
+        except Exception as e:
+            router.report(tier, False, time.monotonic() - t0)
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+
+        ok = res is not None and not seems_invalid(res)
+        router.report(tier, ok, time.monotonic() - t0)
+        if ok:
+            parsed = res
+            trace["tier"] = tier
+            break
+        if parsed is None and res is not None:
+            # неполный результат держим на случай, если остальные тиры не дадут ничего
+            parsed = res
+
+    if parsed is not None:
         data.update(parsed)
-        data["fetchedAt"] = datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
-        return data
-    except Exception as e:
-        data["error"] = f"{type(e).__name__}: {e}"
-        data["fetchedAt"] = datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
-        return data
+    if trace["tier"] is None and (errors or parsed is None):
+        data["error"] = "; ".join(errors) or "no tier produced data"
+    data["fetchedAt"] = _now_iso()
+    if archive is not None and captures:
+        archive.record(account_id, data["fetchedAt"], url, nick, trace["tier"], captures)
+    if cache and is_good(data):
+        if trace["tier"] == "static":
+            cache.remember(account_id, resp, sha1, "static")
+        else:
+            cache.remember(account_id, None, None, trace["tier"])
+    return data
+
+def scrape_one(account_id: int, nickname: Optional[str] = None, session=None) -> Dict:
+    return asyncio.run(scrape_one_async(account_id, nickname, session=session))
+
+# ─────────────────────────────────────────────
+# Конвейер: сеть → пул парсеров → один пакетный писатель
+
+class PipelineStats:
+    """Глубина очередей и время, которое стадии простояли в ожидании (backpressure)."""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def _st(self, stage: str) -> Dict[str, float]:
+        return self.stages.setdefault(stage, {"samples": 0, "depthSum": 0, "depthMax": 0,
+                                              "blockedSeconds": 0.0, "blocked": 0, "batches": 0, "items": 0})
+
+    def depth(self, stage: str, n: int) -> None:
+        st = self._st(stage)
+        st["samples"] += 1
+        st["depthSum"] += n
+        st["depthMax"] = max(st["depthMax"], n)
+
+    def blocked(self, stage: str, seconds: float) -> None:
+        st = self._st(stage)
+        st["blockedSeconds"] += seconds
+        if seconds > 0.001:
+            st["blocked"] += 1
+
+    def batch(self, stage: str, n: int) -> None:
+        st = self._st(stage)
+        st["batches"] += 1
+        st["items"] += n
+
+    def snapshot(self) -> Dict[str, Dict]:
+        out = {}
+        for name, st in sorted(self.stages.items()):
+            out[name] = {
+                "depthAvg": round(st["depthSum"] / st["samples"], 2) if st["samples"] else 0.0,
+                "depthMax": int(st["depthMax"]),
+                "blockedSeconds": round(st["blockedSeconds"], 3),
+                "blocked": int(st["blocked"]),
+            }
+            if st["batches"]:
+                out[name]["batches"] = int(st["batches"])
+                out[name]["avgBatch"] = round(st["items"] / st["batches"], 2)
+        return out
+
+class ParserPool:
+    """Разбор HTML вне event loop: процессы, потоки или inline (auto — по числу ядер).
+
+    В работе не больше workers * 2 страниц: остальные ждут слота, и это
+    ожидание пишется в PipelineStats как backpressure стадии parse.
+    expected — сколько страниц ждать (если известно): auto на малых прогонах — inline.
+    Умер процесс пула (OOM, segfault) — пул пересоздаётся и страница разбирается
+    ещё раз; сломался и новый — дальше inline, без пула.
+    """
+
+    AUTO_MIN_PAGES = 32
+    MAX_RESTARTS = 3
+
+    def __init__(self, workers: int = 2, mode: str = "auto", stats: Optional[PipelineStats] = None,
+                 expected: Optional[int] = None):
+        self.workers = max(1, int(workers))
+        if mode == "auto":
+            # на одном ядре пул только добавляет пересылку страниц между процессами,
+            # а на паре страниц запуск процессов (spawn + импорт модуля) дороже самого разбора
+            small = expected is not None and expected < self.AUTO_MIN_PAGES
+            mode = "process" if (os.cpu_count() or 1) > 1 and not small else "inline"
+        self.mode = mode
+        self.stats = stats
+        self._executor = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight = 0
+        self.restarts = 0
+
+    def _ensure(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers * 2)
+        if self._executor is None and self.mode != "inline":
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            if self.mode == "process":
+                import multiprocessing
+                try:
+                    # spawn: fork из процесса с потоками (to_thread, Playwright) небезопасен
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                except (OSError, ValueError, NotImplementedError):
+                    self.mode = "thread"
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="parse")
+
+    async def parse(self, html: str, url: str) -> Dict:
+        self._ensure()
+        if self._executor is None:
+            return parse_profile_html_static(html, url)
+        t0 = time.monotonic()
+        async with self._slots:
+            if self.stats is not None:
+                self.stats.blocked("parse", time.monotonic() - t0)
+                self.stats.depth("parse", self._inflight)
+            self._inflight += 1
+            try:
+                from concurrent.futures import BrokenExecutor
+                for attempt in range(2):
+                    executor = self._executor
+                    if executor is None:
+                        return parse_profile_html_static(html, url)
+                    try:
+                        return await asyncio.get_running_loop().run_in_executor(
+                            executor, parse_profile_html_static, html, url)
+                    except BrokenExecutor as e:
+                        self._recover(executor, e, give_up=attempt > 0)
+                return parse_profile_html_static(html, url)
+            finally:
+                self._inflight -= 1
+
+    def _recover(self, broken, err: BaseException, give_up: bool) -> None:
+        """Пул сломан: пересоздать (или перейти на inline). Остальные страницы,
+        упавшие на том же пуле, видят, что его уже заменили, и просто повторяют."""
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        if give_up or self.restarts >= self.MAX_RESTARTS:
+            self.mode = "inline"
+            print(f"ParserPool: пул парсеров сломан ({type(err).__name__}), дальше разбор inline", flush=True)
+            return
+        self.restarts += 1
+        print(f"ParserPool: пул парсеров сломан ({type(err).__name__}), пересоздаю "
+              f"({self.restarts}/{self.MAX_RESTARTS})", flush=True)
+        self._ensure()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+class BatchWriter:
+    """Единственный писатель: копит удачные записи и сбрасывает пачками.
+
+    Файлы игроков пишутся в потоке, история — одним коммитом на пачку,
+    журнал — только после записи файлов (чекпоинт не обгоняет диск).
+    Очередь ограничена: если диск не успевает, воркеры ждут в put().
+    Упал писатель (например, OSError при записи) — put() и close() не виснут
+    на полной очереди, а поднимают его ошибку: прогон падает, а не ждёт таймаута.
+    """
+
+    def __init__(self, out_dir: pathlib.Path, history: Optional[HistoryStore] = None,
+                 journal: Optional[RunJournal] = None,
+                 on_result: Optional[Callable[[Dict], None]] = None,
+                 batch: int = 32, maxsize: int = 256,
+                 stats: Optional[PipelineStats] = None, compact: bool = False):
+        self.out_dir = out_dir
+        self.compact = compact
+        self.history = history
+        self.journal = journal
+        self.on_result = on_result
+        self.batch = max(1, batch)
+        self.stats = stats
+        self.queue: "asyncio.Queue[Optional[Tuple[Dict, Optional[Dict]]]]" = asyncio.Queue(maxsize=maxsize)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> "BatchWriter":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def _raise_if_dead(self) -> None:
+        if self._task is not None and self._task.done():
+            exc = None if self._task.cancelled() else self._task.exception()
+            raise RuntimeError(f"писатель результатов остановился: {exc!r}") from exc
+
+    async def _put(self, item) -> None:
+        """queue.put, который прерывается, если писатель умер."""
+        self._raise_if_dead()
+        if not self.queue.full():
+            self.queue.put_nowait(item)
+            return
+        waiter = asyncio.ensure_future(self.queue.put(item))
+        try:
+            await asyncio.wait({waiter, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+        if not waiter.done() or waiter.cancelled():
+            self._raise_if_dead()
+
+    async def put(self, data: Dict, trace: Optional[Dict] = None) -> None:
+        t0 = time.monotonic()
+        await self._put((data, trace))
+        if self.stats is not None:
+            self.stats.blocked("write", time.monotonic() - t0)
+            self.stats.depth("write", self.queue.qsize())
+
+    def _write_files(self, items: List[Dict]) -> List[bool]:
+        return [save_json(self.out_dir, data, self.compact) for data in items]
+
+    async def _run(self) -> None:
+        closing = False
+        while not closing:
+            first = await self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            while len(batch) < self.batch:
+                try:
+                    nxt = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if nxt is None:
+                    closing = True
+                    break
+                batch.append(nxt)
+
+            t0 = time.monotonic()
+            records = [d for d, _ in batch]
+            written = await asyncio.to_thread(self._write_files, records)
+            if self.history is not None:
+                # в историю — только снапшоты с новой статистикой
+                self.history.append_many([d for d, w in zip(records, written) if w])
+            per_item = (time.monotonic() - t0) / len(batch)
+            for (data, trace), w in zip(batch, written):
+                if trace is not None:
+                    phases = trace.setdefault("phases", {})
+                    phases["write"] = phases.get("write", 0.0) + per_item
+                    trace["written"] = w
+                if self.journal is not None:
+                    self.journal.record(data["accountId"], "OK", data)
+                if self.on_result is not None:
+                    self.on_result(data)
+            if self.stats is not None:
+                self.stats.batch("write", len(batch))
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        task = self._task
+        try:
+            if not task.done():
+                await self._put(None)
+        finally:
+            self._task = None
+        await task
+
+# ─────────────────────────────────────────────
+# Асинхронный движок: много аккаунтов одновременно
+
+async def run_jobs(jobs: Iterable[Dict], out_dir: pathlib.Path, session=None,
+                   concurrency: int = 4, per_host: int = 4,
+                   pool: Optional[BrowserPool] = None,
+                   cache: Optional[FreshnessCache] = None,
+                   prev_map: Optional[Dict[int, Dict]] = None,
+                   render: bool = True,
+                   traces: Optional[List[Dict]] = None,
+                   verbose: bool = True,
+                   history: Optional[HistoryStore] = None,
+                   journal: Optional[RunJournal] = None,
+                   router: Optional[TierRouter] = None,
+                   limiter: Optional[HostRateLimiter] = None,
+                   collect: bool = True,
+                   budget: Optional["RunBudget"] = None,
+                   on_result: Optional[Callable[[Dict], None]] = None,
+                   archive: Optional[PageArchive] = None,
+                   parser: Optional[ParserPool] = None,
+                   pipeline: Optional[PipelineStats] = None,
+                   write_batch: int = 32,
+                   compact: bool = False) -> Dict[int, Dict]:
+    """Гоняет scrape_one_async по очереди jobs в concurrency воркеров.
+
+    jobs может быть генератором (потоковый ростер): читаем его пачками в
+    ограниченную очередь, так что парсинг идёт, пока файл ещё дочитывается.
+    Возвращает {accountId: data} только для успешно обновлённых профилей
+    (collect=False — не копить их: всё уже лежит в <out>/<id>.json).
+    pool — общий BrowserPool для Playwright-тира (закрывает вызывающий).
+    cache + prev_map включают пропуск свежих и неизменившихся профилей.
+    В traces (если передан) дописываем по записи на аккаунт:
+    accountId, status (OK/SKIP/ERR/FRESH/UNCHANGED), tier, seconds.
+    history — куда дописывать каждый удачный результат,
+    journal — куда чекпоинтить каждый обработанный аккаунт.
+    router — общий на прогон TierRouter, limiter — HostRateLimiter (темп
+    запросов; фиксированных пауз между аккаунтами больше нет).
+    budget — RunBudget: когда запросы/время кончились, оставшиеся аккаунты
+    получают статус BUDGET и не журналируются (их подхватит следующий прогон).
+    on_result — вызывается с каждой удачной записью сразу после сохранения.
+    archive — PageArchive для сырья (см. reparse).
+    Стадии: воркеры ходят в сеть, HTML разбирает parser (ParserPool),
+    удачные записи пишет один BatchWriter пачками по write_batch.
+    Глубину очередей и ожидание стадий собирает pipeline (PipelineStats).
+    """
+    router = router or TierRouter()
+    limiter = limiter or HostRateLimiter()
+    prev_map = prev_map or {}
+    limits = HostLimits(per_host)
+    total = len(jobs) if hasattr(jobs, "__len__") else None
+    n_workers = max(1, concurrency if total is None else min(concurrency, total))
+    queue: "asyncio.Queue[Optional[Dict]]" = asyncio.Queue(maxsize=n_workers * 4)
+    done = 0
+    updated_map: Dict[int, Dict] = {}
+    writer = BatchWriter(out_dir, history, journal, on_result, batch=write_batch,
+                         maxsize=max(write_batch * 4, n_workers * 2), stats=pipeline, compact=compact).start()
+
+    def _take(it, n: int) -> List[Dict]:
+        batch = []
+        for job in it:
+            batch.append(job)
+            if len(batch) >= n:
+                break
+        return batch
+
+    async def producer():
+        it = iter(jobs)
+        while True:
+            # Ростер может читаться из большого файла или stdin — в потоке, пачками
+            batch = await asyncio.to_thread(_take, it, 256)
+            if not batch:
+                break
+            for job in batch:
+                t0 = time.monotonic()
+                await queue.put(job)
+                if pipeline is not None:
+                    pipeline.blocked("fetch", time.monotonic() - t0)
+                    pipeline.depth("fetch", queue.qsize())
+        for _ in range(n_workers):
+            await queue.put(None)
+
+    async def worker():
+        nonlocal done
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            acc, name = job["id"], job.get("name")
+            prev = prev_map.get(acc)
+            dst = out_dir / f"{acc}.json"
+            has_prev = prev is not None and is_good(prev) and dst.exists()
+
+            trace: Dict = {"accountId": acc, "tier": None}
+            t0 = time.monotonic()
+
+            if cache and has_prev and cache.is_fresh(acc, prev):
+                done += 1
+                trace.update(status="FRESH", seconds=0.0)
+                if journal is not None:
+                    journal.record(acc, "FRESH")
+                if traces is not None:
+                    traces.append(trace)
+                if verbose:
+                    print(f"[{done}/{total or '?'}] {acc} ({name or '-'}) ... FRESH: skip", flush=True)
+                continue
+
+            if budget is not None and not budget.start():
+                done += 1
+                trace.update(status="BUDGET", seconds=0.0)
+                if traces is not None:
+                    traces.append(trace)
+                if verbose:
+                    print(f"[{done}/{total or '?'}] {acc} ({name or '-'}) ... BUDGET: skip", flush=True)
+                continue
+
+            data = await scrape_one_async(acc, name, session=session, limits=limits, pool=pool,
+                                          cache=cache, conditional=has_prev, render=render,
+                                          trace=trace, router=router, limiter=limiter,
+                                          archive=archive, parser=parser)
+            if budget is not None:
+                budget.spend(trace.get("requests", 0))
+
+            if data.get("notModified"):
+                trace.update(status="UNCHANGED", checkedAt=_now_iso())
+                status = "UNCHANGED: keep previous stats"
+            elif is_good(data):
+                await writer.put(data, trace)
+                if collect:
+                    updated_map[acc] = data
+                trace["status"] = status = "OK"
+            elif dst.exists():
+                # При сбое не перезаписываем хороший файл, в индексе остаётся старая запись
+                trace["status"] = "SKIP"
+                status = "SKIP: keep previous stats"
+            else:
+                trace["status"] = "ERR"
+                status = f"ERR: {data.get('error','invalid data')}"
+
+            trace["seconds"] = time.monotonic() - t0
+            if journal is not None and trace["status"] != "OK":
+                # OK журналирует BatchWriter — после того, как файл записан
+                journal.record(acc, trace["status"])
+            if traces is not None:
+                traces.append(trace)
+            done += 1
+            if verbose:
+                print(f"[{done}/{total or '?'}] {acc} ({name or '-'}) ... {status}", flush=True)
+
+    tasks = [asyncio.create_task(producer())] + [asyncio.create_task(worker()) for _ in range(n_workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # упал писатель или воркер — остальных не оставляем висеть на очередях
+        for t in tasks:
+            t.cancel()
+        raise
+    finally:
+        await writer.close()
+    return updated_map
+
+async def run_api_tier(jobs: List[Dict], out_dir: pathlib.Path, app_id: str, session=None,
+                       cache: Optional[FreshnessCache] = None,
+                       prev_map=None,
+                       traces: Optional[List[Dict]] = None,
+                       verbose: bool = True,
+                       history: Optional[HistoryStore] = None,
+                       journal: Optional[RunJournal] = None,
+                       limiter: Optional[HostRateLimiter] = None,
+                       budget: Optional["RunBudget"] = None,
+                       on_result: Optional[Callable[[Dict], None]] = None,
+                       batch: int = API_BATCH,
+                       compact: bool = False) -> Tuple[List[Dict], Dict[int, Dict]]:
+    """Первый тир: весь ростер через account/info пачками по batch.
+
+    Возвращает (оставшиеся задания, {accountId: data}). Дальше в run_jobs идут
+    только аккаунты, которых нет в ответе или чьи данные не прошли is_good;
+    свежие (--max-age) API не трогает и оставляет run_jobs. Сломался запрос —
+    API выключается до конца прогона, остальное досканируется как раньше.
+    """
+    limiter = limiter or HostRateLimiter()
+    prev_map = prev_map or {}
+    rest: List[Dict] = []
+    todo: List[Dict] = []
+    for job in jobs:
+        prev = prev_map.get(job["id"])
+        fresh = (cache is not None and prev is not None and is_good(prev)
+                 and (out_dir / f"{job['id']}.json").exists() and cache.is_fresh(job["id"], prev))
+        (rest if fresh else todo).append(job)
+
+    updated: Dict[int, Dict] = {}
+    broken = False
+    for i in range(0, len(todo), batch):
+        chunk = todo[i:i + batch]
+        if broken or (budget is not None and not budget.start()):
+            rest.extend(chunk)
+            continue
+        trace: Dict = {}
+        t0 = time.monotonic()
+        try:
+            with _phase(trace, "api"):
+                infos = await fetch_api_batch([j["id"] for j in chunk], app_id, session, limiter, trace)
+        except Exception as e:
+            broken = True
+            print(f"API: {type(e).__name__}: {e} — дальше без API", flush=True)
+            rest.extend(chunk)
+            continue
+        finally:
+            if budget is not None:
+                budget.spend(trace.get("requests", 0))
+        seconds = (time.monotonic() - t0) / len(chunk)
+
+        for job in chunk:
+            acc = job["id"]
+            info = infos.get(acc)
+            data = None
+            if info:
+                data = {"accountId": acc, **_map_api_account(info, job.get("name"), prev_map.get(acc)),
+                        "fetchedAt": _now_iso()}
+            if data is None or not is_good(data):
+                rest.append(job)
+                continue
+            written = save_json(out_dir, data, compact)
+            if history is not None and written:
+                history.append(data)
+            if cache is not None:
+                cache.touch(acc, "api")
+            if journal is not None:
+                journal.record(acc, "OK", data)
+            if on_result is not None:
+                on_result(data)
+            updated[acc] = data
+            if traces is not None:
+                # запрос и байты пачки делим поровну между её аккаунтами
+                traces.append({"accountId": acc, "tier": "api", "status": "OK", "seconds": seconds,
+                               "phases": {"api": seconds}, "written": written,
+                               "requests": 1 if job is chunk[0] else 0,
+                               "bytes": trace.get("bytes", 0) // len(chunk)})
+        if verbose:
+            got = sum(1 for j in chunk if j["id"] in updated)
+            print(f"API: пачка {i // batch + 1}: {got}/{len(chunk)} из ответа", flush=True)
+
+    return rest, updated
+
+# ─────────────────────────────────────────────
+# Приоритет обновления: сетка плей-офф, устаревание, темп изменений
+
+# Та же топология, что FLOW в js/bracket.runner.js: матч → (куда победитель, куда проигравший)
+PLAYOFF_FLOW: Dict[str, Dict[str, Tuple[str, int]]] = {
+    "W-R1-M1": {"win": ("W-Q2", 2), "lose": ("L-R1-M2", 2)},
+    "W-R1-M2": {"win": ("W-Q3", 2), "lose": ("L-R1-M3", 2)},
+    "W-R1-M3": {"win": ("W-Q4", 2), "lose": ("L-R1-M4", 2)},
+    "W-R1-M4": {"win": ("W-Q1", 2), "lose": ("L-R1-M1", 2)},
+    "W-Q1": {"win": ("W-S1", 1), "lose": ("L-R1-M4", 1)},
+    "W-Q2": {"win": ("W-S1", 2), "lose": ("L-R1-M1", 1)},
+    "W-Q3": {"win": ("W-S2", 1), "lose": ("L-R1-M2", 1)},
+    "W-Q4": {"win": ("W-S2", 2), "lose": ("L-R1-M3", 1)},
+    "W-S1": {"win": ("W-F", 1), "lose": ("L-R3-M1", 1)},
+    "W-S2": {"win": ("W-F", 2), "lose": ("L-R3-M2", 1)},
+    "W-F": {"win": ("GF", 1), "lose": ("P3", 1)},
+    "L-R1-M1": {"win": ("L-R2-M1", 1)},
+    "L-R1-M2": {"win": ("L-R2-M1", 2)},
+    "L-R1-M3": {"win": ("L-R2-M2", 1)},
+    "L-R1-M4": {"win": ("L-R2-M2", 2)},
+    "L-R2-M1": {"win": ("L-R3-M1", 2)},
+    "L-R2-M2": {"win": ("L-R3-M2", 2)},
+    "L-R3-M1": {"win": ("L-F", 1)},
+    "L-R3-M2": {"win": ("L-F", 2)},
+    "L-F": {"win": ("GF", 2), "lose": ("P3", 2)},
+}
+
+PLAYOFF_ORDER = (
+    "W-R1-M1", "W-R1-M2", "W-R1-M3", "W-R1-M4",
+    "W-Q1", "W-Q2", "W-Q3", "W-Q4",
+    "W-S1", "W-S2",
+    "W-F",
+    "L-R1-M1", "L-R1-M2", "L-R1-M3", "L-R1-M4",
+    "L-R2-M1", "L-R2-M2",
+    "L-R3-M1", "L-R3-M2",
+    "L-F",
+    "GF", "P3",
+)
+
+# Стартовая расстановка (seedInitialTeams): (матч, слот) → посев
+PLAYOFF_SEEDS = {
+    ("W-R1-M1", 1): 5, ("W-R1-M1", 2): 12,
+    ("W-R1-M2", 1): 6, ("W-R1-M2", 2): 11,
+    ("W-R1-M3", 1): 7, ("W-R1-M3", 2): 10,
+    ("W-R1-M4", 1): 8, ("W-R1-M4", 2): 9,
+    ("W-Q1", 1): 1, ("W-Q2", 1): 4, ("W-Q3", 1): 3, ("W-Q4", 1): 2,
+}
+
+def bracket_alive(playoff: Dict) -> Dict[str, bool]:
+    """Имя команды → есть ли у неё ещё несыгранный матч.
+
+    Прогоняем results по FLOW, как applyResults на фронтенде; живы те, кто
+    стоит в матче без победителя. Вылетевшие и доигравшие (GF/P3) — False.
+    """
+    by_seed = {t.get("seed"): t.get("name") for t in playoff.get("teams", [])}
+    board: Dict[str, List[Optional[str]]] = {m: [None, None] for m in PLAYOFF_ORDER}
+    for (mid, slot), seed in PLAYOFF_SEEDS.items():
+        board[mid][slot - 1] = by_seed.get(seed)
+    results = playoff.get("results") or {}
+    decided = set()
+    for mid in PLAYOFF_ORDER:
+        try:
+            w = int(results.get(mid))
+        except (TypeError, ValueError):
+            continue
+        if w not in (1, 2) or not all(board[mid]):
+            continue
+        decided.add(mid)
+        edge = PLAYOFF_FLOW.get(mid, {})
+        winner, loser = board[mid][w - 1], board[mid][2 - w]
+        if "win" in edge:
+            board[edge["win"][0]][edge["win"][1] - 1] = winner
+        if "lose" in edge:
+            board[edge["lose"][0]][edge["lose"][1] - 1] = loser
+
+    alive = {name: False for name in by_seed.values() if name}
+    for mid, slots in board.items():
+        if mid not in decided:
+            for name in slots:
+                if name:
+                    alive[name] = True
+    return alive
+
+def parse_budget(spec: Optional[str]) -> "RunBudget":
+    """'300' → 300 запросов; '20m' / '90s' / '1h' → секунды."""
+    if not spec:
+        return RunBudget()
+    spec = str(spec).strip().lower()
+    if spec.isdigit():
+        return RunBudget(requests=int(spec))
+    return RunBudget(seconds=_parse_duration(spec))
+
+class RunBudget:
+    """Лимит на прогон: число HTTP-запросов (все тиры) и/или секунды с начала.
+
+    Аккаунт в работе резервирует один запрос (меньше не бывает), поэтому
+    параллельные воркеры не проскакивают лимит; перерасход возможен только
+    на ретраях и фолбэках уже начатых аккаунтов.
+    """
+
+    def __init__(self, requests: Optional[int] = None, seconds: Optional[float] = None):
+        self.requests = requests
+        self.seconds = seconds
+        self.spent = 0
+        self.inflight = 0
+        self.t0 = time.monotonic()
+
+    def exhausted(self) -> bool:
+        if self.requests is not None and self.spent + self.inflight >= self.requests:
+            return True
+        return self.seconds is not None and time.monotonic() - self.t0 >= self.seconds
+
+    def start(self) -> bool:
+        """Зарезервировать место под аккаунт; False — бюджет кончился."""
+        if self.exhausted():
+            return False
+        self.inflight += 1
+        return True
+
+    def spend(self, n: int) -> None:
+        self.inflight = max(0, self.inflight - 1)
+        self.spent += n
+
+    def __str__(self) -> str:
+        parts = []
+        if self.requests is not None:
+            parts.append(f"{self.spent}/{self.requests} запросов")
+        if self.seconds is not None:
+            parts.append(f"{time.monotonic() - self.t0:.0f}/{self.seconds:.0f} с")
+        return ", ".join(parts) or "без лимита"
+
+class PriorityScheduler:
+    """Порядок обновления аккаунтов по важности.
+
+    score = устаревание + сетка + темп изменений:
+    - устаревание: часы с последней проверки / 24, не больше 4 (нет записи — 4);
+    - сетка: игрок живой команды +3, вылетевшей −2, вне команд или сетки 0;
+    - темп: бои в сутки за последнюю неделю по истории / 10, не больше 2.
+    """
+
+    STALE_CAP = 4.0
+    ALIVE, OUT = 3.0, -2.0
+    RATE_CAP = 2.0
+
+    def __init__(self, data_dir: pathlib.Path, prev_map=None,
+                 cache: Optional[FreshnessCache] = None,
+                 history: Optional[HistoryStore] = None):
+        self.prev_map = prev_map or {}
+        self.cache = cache
+        self.history = history
+        self.now = datetime.now(timezone.utc)
+        playoff = _read_json(data_dir / "playoff12.json") or {}
+        teams = (_read_json(data_dir / "teams.json") or {}).get("teams", []) or playoff.get("teams", [])
+        # Без сетки все команды считаем живыми; с сеткой команда не из сетки — нейтральна (None)
+        alive = bracket_alive(playoff) if playoff.get("teams") else None
+        self.team_of: Dict[str, Optional[bool]] = {}
+        for t in teams:
+            state = alive.get(t.get("name")) if alive is not None else True
+            for nick in t.get("players", []):
+                self.team_of[str(nick).strip().lower()] = state
+
+    def alive(self, job: Dict) -> Optional[bool]:
+        """True/False — команда в сетке жива/выбыла; None — игрок вне команд или команды нет в сетке."""
+        prev = self.prev_map.get(job["id"]) or {}
+        for nick in (job.get("name"), prev.get("nickname")):
+            if nick and str(nick).strip().lower() in self.team_of:
+                return self.team_of[str(nick).strip().lower()]
+        return None
+
+    def _staleness(self, acc: int) -> float:
+        prev = self.prev_map.get(acc) or {}
+        stamps = [_parse_iso(prev.get("fetchedAt"))]
+        if self.cache is not None:
+            stamps.append(_parse_iso((self.cache.entries.get(acc) or {}).get("checkedAt")))
+        stamps = [t for t in stamps if t is not None]
+        if not stamps:
+            return self.STALE_CAP
+        hours = (self.now - max(stamps)).total_seconds() / 3600
+        return max(0.0, min(hours / 24, self.STALE_CAP))
+
+    def _change_rate(self, acc: int) -> float:
+        if self.history is None:
+            return 0.0
+        since = (self.now - timedelta(days=7)).isoformat(timespec="seconds").replace("+00:00", "Z")
+        rows = [r for r in self.history.range(acc, since) if r.get("battles") is not None]
+        if len(rows) < 2:
+            return 0.0
+        t0, t1 = _parse_iso(rows[0]["fetchedAt"]), _parse_iso(rows[-1]["fetchedAt"])
+        if t0 is None or t1 is None or t1 <= t0:
+            return 0.0
+        per_day = (rows[-1]["battles"] - rows[0]["battles"]) / ((t1 - t0).total_seconds() / 86400)
+        return max(0.0, min(per_day / 10, self.RATE_CAP))
+
+    def score(self, job: Dict) -> float:
+        alive = self.alive(job)
+        bracket = 0.0 if alive is None else (self.ALIVE if alive else self.OUT)
+        return round(self._staleness(job["id"]) + bracket + self._change_rate(job["id"]), 3)
+
+    def order(self, jobs: List[Dict], alive_only: bool = False) -> List[Dict]:
+        """Самые важные — первыми; alive_only выкидывает игроков вылетевших команд."""
+        scored = []
+        for j in jobs:
+            if alive_only and self.alive(j) is False:
+                continue
+            scored.append((-self.score(j), j["id"], j))
+        return [j for _, _, j in sorted(scored, key=lambda x: (x[0], x[1]))]
+
+# ─────────────────────────────────────────────
+# Шардирование: --shard K/N и детерминированный merge частичных результатов
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """'2/4' → (2, 4); K считается с 1."""
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec or "")
+    if not m:
+        raise ValueError(f"bad shard: {spec!r} (нужно K/N)")
+    k, n = int(m.group(1)), int(m.group(2))
+    if not (n >= 1 and 1 <= k <= n):
+        raise ValueError(f"bad shard: {spec!r} (нужно 1 <= K <= N)")
+    return k, n
+
+def shard_of(account_id: int, n: int) -> int:
+    """Номер шарда (с 1) для аккаунта: стабилен между запусками и машинами."""
+    return zlib.crc32(str(int(account_id)).encode("ascii")) % n + 1
+
+def partial_name(k: int, n: int) -> str:
+    return f"partial-{k}-of-{n}.json"
+
+def save_partial(out_dir: pathlib.Path, k: int, n: int, players: List[Dict],
+                 cache: Optional[FreshnessCache] = None) -> pathlib.Path:
+    ids = {int(p["accountId"]) for p in players}
+    payload = {
+        "shard": f"{k}/{n}",
+        "generatedAt": _now_iso(),
+        "players": sorted(players, key=lambda p: p["accountId"]),
+        "cache": {str(acc): e for acc, e in sorted((cache.entries if cache else {}).items())
+                  if shard_of(acc, n) == k or acc in ids},
+    }
+    path = out_dir / partial_name(k, n)
+    _atomic_write_text(path, json.dumps(payload, ensure_ascii=False, indent=1))
+    return path
+
+def _pick_newer(a: Optional[Dict], b: Dict) -> Dict:
+    """Из двух записей одного аккаунта — более свежая; при равенстве — по содержимому.
+    От порядка аргументов результат не зависит."""
+    if a is None:
+        return b
+    ka = (a.get("fetchedAt") or "", json.dumps(a, sort_keys=True, ensure_ascii=False))
+    kb = (b.get("fetchedAt") or "", json.dumps(b, sort_keys=True, ensure_ascii=False))
+    return a if ka >= kb else b
+
+def merge_partials(out_dir: pathlib.Path, partial_paths: Iterable[pathlib.Path],
+                   history: Optional[HistoryStore] = None,
+                   compact: bool = False) -> Tuple[List[Dict], Optional[str]]:
+    """index.json + частичные результаты шардов → новый индекс.
+
+    Правило то же, что в main(): в индекс идут только хорошие записи,
+    у остальных аккаунтов остаётся прошлая. Порядок файлов не важен.
+    Возвращает (players, generatedAt) — generatedAt берём самый поздний из шардов.
+    """
+    updated: Dict[int, Dict] = {}
+    cache_entries: Dict[int, Dict] = {}
+    stamps: List[str] = []
+    for path in sorted(pathlib.Path(p) for p in partial_paths):
+        payload = _read_json(path)
+        if not isinstance(payload, dict):
+            print(f"SKIP {path}: не JSON")
+            continue
+        if payload.get("generatedAt"):
+            stamps.append(payload["generatedAt"])
+        for rec in payload.get("players", []):
+            if "accountId" in rec and is_good(rec):
+                acc = int(rec["accountId"])
+                updated[acc] = _pick_newer(updated.get(acc), rec)
+        for acc, entry in (payload.get("cache") or {}).items():
+            acc = int(acc)
+            prev = cache_entries.get(acc)
+            if prev is None or (entry.get("checkedAt") or "", json.dumps(entry, sort_keys=True)) > \
+                    (prev.get("checkedAt") or "", json.dumps(prev, sort_keys=True)):
+                cache_entries[acc] = entry
+
+    merged = load_index(out_dir)
+    for acc, rec in sorted(updated.items()):
+        prev = merged.get(acc)
+        if prev is not None and (prev.get("fetchedAt") or "") > (rec.get("fetchedAt") or ""):
+            # в индексе уже есть запись новее, чем пришла из шарда
+            continue
+        save_json(out_dir, rec, compact)
+        # сравниваем с индексом, а не с файлом: шард мог уже записать <id>.json в тот же out
+        if history is not None and not same_stats(prev, rec):
+            history.append(rec)
+        merged[acc] = stable_record(prev, rec)
+
+    if cache_entries:
+        cache = FreshnessCache(out_dir)
+        cache.entries.update(cache_entries)
+        cache.dirty = True
+        cache.save()
+    save_freshness(out_dir, {acc: rec.get("fetchedAt") for acc, rec in updated.items()})
+
+    return [merged[k] for k in sorted(merged)], (max(stamps) if stamps else None)
+
+# ─────────────────────────────────────────────
+# Метрики прогона: run-report.json + Prometheus textfile
+
+PHASES = ("api", "fetch", "parse", "render", "jina", "map", "archive", "write")
+# render_* — подфазы render: запуск Chromium, новая страница, goto, перехват XHR,
+# ожидание значений, чтение DOM
+RENDER_PHASES = ("render_launch", "render_page", "render_goto", "render_capture", "render_wait", "render_eval")
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q * (len(v) - 1))))]
+
+class _Reservoir:
+    """count/sum/max ряда + равномерная выборка не больше size значений для перцентилей."""
+
+    __slots__ = ("size", "count", "sum", "max", "values", "_rng")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.values: List[float] = []
+        self._rng = random.Random(size)
+
+    def add(self, v: float) -> None:
+        self.count += 1
+        self.sum += v
+        self.max = v if self.count == 1 else max(self.max, v)
+        if len(self.values) < self.size:
+            self.values.append(v)
+        else:
+            i = self._rng.randrange(self.count)
+            if i < self.size:
+                self.values[i] = v
+
+    def pct(self, q: float) -> float:
+        return _pct(self.values, q)
+
+class TraceStats:
+    """Сводка по trace-записям аккаунтов, собираемая на лету.
+
+    run_jobs и run_api_tier зовут traces.append(trace) — сюда можно передать
+    этот объект вместо списка: копятся счётчики и выборки для перцентилей
+    (не больше SAMPLE значений на ряд), так что память не растёт с ростером.
+    on_trace — вызывается с каждой записью (например, для отметок свежести).
+    """
+
+    SAMPLE = 4096
+
+    def __init__(self, on_trace: Optional[Callable[[Dict], None]] = None):
+        self.on_trace = on_trace
+        self.n = 0
+        self.status: Dict[str, int] = {}
+        self.tiers: Dict[str, int] = {}
+        self.retries = self.bytes = self.requests = self.parse_errors = 0
+        self.writes = {"written": 0, "unchanged": 0}
+        self.latency = _Reservoir(self.SAMPLE)
+        self.phases: Dict[str, _Reservoir] = {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    def append(self, t: Dict) -> None:
+        self.n += 1
+        st = t.get("status") or "?"
+        self.status[st] = self.status.get(st, 0) + 1
+        if t.get("tier"):
+            self.tiers[t["tier"]] = self.tiers.get(t["tier"], 0) + 1
+        for name, sec in (t.get("phases") or {}).items():
+            if name not in self.phases:
+                self.phases[name] = _Reservoir(self.SAMPLE)
+            self.phases[name].add(sec)
+        self.retries += t.get("retries", 0)
+        self.bytes += t.get("bytes", 0)
+        self.requests += t.get("requests", 0)
+        self.parse_errors += t.get("parseErrors", 0)
+        if "written" in t:
+            self.writes["written" if t["written"] else "unchanged"] += 1
+        if st != "FRESH":
+            self.latency.add(t.get("seconds", 0.0))
+        if self.on_trace is not None:
+            self.on_trace(t)
+
+    def extend(self, traces: Iterable[Dict]) -> None:
+        for t in traces:
+            self.append(t)
+
+class RunReport:
+    """Сводка по trace-записям аккаунтов (см. run_jobs): список или TraceStats."""
+
+    JSON_FILE = "run-report.json"
+    PROM_FILE = "scrape.prom"
+
+    def __init__(self, traces, started_at: str, wall_seconds: float,
+                 router: Optional["TierRouter"] = None,
+                 limiter: Optional[HostRateLimiter] = None,
+                 pipeline: Optional[PipelineStats] = None):
+        if not isinstance(traces, TraceStats):
+            stats = TraceStats()
+            stats.extend(traces)
+            traces = stats
+        self.traces = traces
+        self.started_at = started_at
+        self.wall = wall_seconds
+        self.router = router
+        self.limiter = limiter
+        self.pipeline = pipeline
+
+    def summary(self) -> Dict:
+        ts = self.traces
+        lat = ts.latency
+        return {
+            "startedAt": self.started_at,
+            "finishedAt": _now_iso(),
+            "wallSeconds": round(self.wall, 3),
+            "accounts": len(ts),
+            "status": dict(ts.status),
+            "tiers": dict(ts.tiers),
+            "requests": ts.requests,
+            "retries": ts.retries,
+            "parseErrors": ts.parse_errors,
+            "bytes": ts.bytes,
+            "writes": dict(ts.writes),
+            "accountSeconds": {
+                "count": lat.count,
+                "sum": round(lat.sum, 3),
+                "p50": round(lat.pct(0.5), 3),
+                "p95": round(lat.pct(0.95), 3),
+                "max": round(lat.max, 3),
+            },
+            "phases": {
+                name: {
+                    "count": r.count,
+                    "sum": round(r.sum, 3),
+                    "p50": round(r.pct(0.5), 3),
+                    "p95": round(r.pct(0.95), 3),
+                    "max": round(r.max, 3),
+                }
+                for name, r in sorted(ts.phases.items())
+            },
+            "router": self.router.state if self.router else None,
+            "disabledTiers": dict(self.router.disabled) if self.router else {},
+            "hosts": self.limiter.snapshot() if self.limiter else None,
+            "pipeline": self.pipeline.snapshot() if self.pipeline else None,
+        }
+
+    def to_prometheus(self, summary: Dict) -> str:
+        lines: List[str] = []
+
+        def metric(name: str, help_: str, samples: List[Tuple[str, float]]):
+            lines.append(f"# HELP lesta_scrape_{name} {help_}")
+            lines.append(f"# TYPE lesta_scrape_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"lesta_scrape_{name}{labels} {value}")
+
+        def summary_metric(name: str, help_: str, rows: List[Tuple[str, Dict]]):
+            # настоящий summary: квантили + _sum/_count одного семейства; rows — (метки без скобок, p50/p95/sum/count)
+            lines.append(f"# HELP lesta_scrape_{name} {help_}")
+            lines.append(f"# TYPE lesta_scrape_{name} summary")
+            for labels, v in rows:
+                sep = "," if labels else ""
+                for q, k in (("0.5", "p50"), ("0.95", "p95")):
+                    lines.append(f'lesta_scrape_{name}{{{labels}{sep}quantile="{q}"}} {v[k]}')
+                wrap = f"{{{labels}}}" if labels else ""
+                lines.append(f"lesta_scrape_{name}_sum{wrap} {v['sum']}")
+                lines.append(f"lesta_scrape_{name}_count{wrap} {v['count']}")
+
+        metric("last_run_timestamp_seconds", "Unix time the last run finished.",
+               [("", int(time.time()))])
+        metric("duration_seconds", "Wall-clock duration of the last run.", [("", summary["wallSeconds"])])
+        metric("accounts", "Accounts processed in the last run by status.",
+               [(f'{{status="{k}"}}', v) for k, v in sorted(summary["status"].items())])
+        metric("tier_accounts", "Accounts whose stats came from the tier.",
+               [(f'{{tier="{k}"}}', v) for k, v in sorted(summary["tiers"].items())])
+        metric("requests", "Requests sent by all tiers in the last run.", [("", summary.get("requests", 0))])
+        metric("retries", "HTTP retries in the last run.", [("", summary["retries"])])
+        metric("parse_errors", "Downloaded pages the HTML parser failed on (not counted against the tier).",
+               [("", summary.get("parseErrors", 0))])
+        metric("bytes", "Bytes downloaded by static and Jina tiers.", [("", summary["bytes"])])
+        metric("stat_files", "Successful accounts by whether stats/<id>.json was rewritten.",
+               [(f'{{result="{k}"}}', v) for k, v in sorted(summary.get("writes", {}).items())])
+        summary_metric("account_seconds", "Per-account latency in the last run.",
+                       [("", summary["accountSeconds"])])
+        metric("account_seconds_max", "Slowest account in the last run.",
+               [("", summary["accountSeconds"]["max"])])
+        summary_metric("phase_seconds", "Time accounts spent in the phase in the last run.",
+                       [(f'phase="{k}"', v) for k, v in summary["phases"].items()])
+        if summary.get("router"):
+            metric("tier_ok_ratio", "EWMA success ratio of the tier.",
+                   [(f'{{tier="{k}"}}', round(v["ok"], 3)) for k, v in summary["router"].items()])
+            metric("tier_open", "1 if the tier circuit breaker is open.",
+                   [(f'{{tier="{k}"}}', int(v["openUntil"] > time.time())) for k, v in summary["router"].items()])
+            metric("tier_disabled", "1 if the tier was disabled by the pre-flight check.",
+                   [(f'{{tier="{k}"}}', int(k in summary.get("disabledTiers", {}))) for k in summary["router"]])
+        if summary.get("hosts"):
+            metric("host_rate", "Adaptive request rate per host at the end of the run, req/s.",
+                   [(f'{{host="{k}"}}', v["rate"]) for k, v in sorted(summary["hosts"].items())])
+            metric("host_errors", "Throttling/server errors per host (403/429/5xx/network).",
+                   [(f'{{host="{k}"}}', v["errors"]) for k, v in sorted(summary["hosts"].items())])
+        if summary.get("pipeline"):
+            metric("queue_depth_max", "Max queue depth seen by the pipeline stage.",
+                   [(f'{{stage="{k}"}}', v["depthMax"]) for k, v in summary["pipeline"].items()])
+            metric("queue_depth_avg", "Average queue depth seen by the pipeline stage.",
+                   [(f'{{stage="{k}"}}', v["depthAvg"]) for k, v in summary["pipeline"].items()])
+            metric("backpressure_seconds", "Time producers spent blocked on the stage's full queue.",
+                   [(f'{{stage="{k}"}}', v["blockedSeconds"]) for k, v in summary["pipeline"].items()])
+        return "\n".join(lines) + "\n"
+
+    def write(self, out_dir: pathlib.Path, suffix: str = "") -> Dict:
+        summary = self.summary()
+        json_name = self.JSON_FILE.replace(".json", f"{suffix}.json")
+        prom_name = self.PROM_FILE.replace(".prom", f"{suffix}.prom")
+        _atomic_write_text(out_dir / json_name, json.dumps(summary, ensure_ascii=False, indent=2))
+        _atomic_write_text(out_dir / prom_name, self.to_prometheus(summary))
+        return summary
+
+# ─────────────────────────────────────────────
+# Демон: serve — тёплый браузер, фоновое обновление, локальный HTTP API
+
+class StatsService:
+    """Последние результаты в памяти + готовые ответы для HTTP с ETag.
+
+    Пишет в него цикл обновления (asyncio-поток), читают HTTP-потоки —
+    всё под одним lock. Тела ответов собираются лениво и кэшируются до
+    следующего изменения (version).
+    """
+
+    def __init__(self, out_dir: pathlib.Path, data_dir: pathlib.Path, compact: bool = False):
+        self.out_dir = out_dir
+        self.data_dir = data_dir
+        self.compact = compact
+        self.players: Dict[int, Dict] = load_index(out_dir)
+        self.aliases: Dict[str, int] = {}
+        # accountId → fetchedAt: обновляется каждый цикл, но version не двигает
+        self.fresh: Dict[int, str] = {}
+        self.fresh_dirty = False
+        self.version = 0
+        self.flushed_version = 0
+        self.status: Dict = {"startedAt": _now_iso(), "cycles": 0}
+        self._lock = threading.Lock()
+        self._bodies: Dict[str, Tuple[int, bytes, str]] = {}
+
+    def update(self, data: Dict) -> None:
+        with self._lock:
+            acc = int(data["accountId"])
+            self.fresh[acc] = data.get("fetchedAt")
+            self.fresh_dirty = True
+            if same_stats(self.players.get(acc), data):
+                return
+            self.players[acc] = data
+            self.version += 1
+
+    def touch(self, stamps: Dict[int, str]) -> None:
+        """Отметки свежести без новых данных (UNCHANGED)."""
+        if not stamps:
+            return
+        with self._lock:
+            self.fresh.update(stamps)
+            self.fresh_dirty = True
+
+    def set_status(self, **fields) -> None:
+        with self._lock:
+            self.status.update(fields)
+
+    def set_aliases(self, aliases: Dict[str, int]) -> None:
+        with self._lock:
+            if aliases != self.aliases:
+                self.aliases = aliases
+                self.version += 1
+
+    def items(self) -> List[Dict]:
+        with self._lock:
+            return [self.players[k] for k in sorted(self.players)]
+
+    def _render(self, key: str):
+        if key == "index":
+            return {"generatedAt": self.status.get("lastCycleAt") or _now_iso(),
+                    "players": [self.players[k] for k in sorted(self.players)]}
+        if key == "bundle":
+            return build_bundle([self.players[k] for k in sorted(self.players)], self.data_dir, self.aliases)
+        if key == "status":
+            return dict(self.status, players=len(self.players), version=self.version)
+        if key == "freshness":
+            return {"players": {str(k): self.fresh[k] for k in sorted(self.fresh)}}
+        if key.startswith("player:"):
+            return self.players.get(int(key.split(":", 1)[1]))
+        if key.startswith("data:"):
+            return _read_json(self.data_dir / key.split(":", 1)[1])
+        return None
+
+    def body(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """(тело, ETag) или None. data:* перечитываем с диска: их правят руками."""
+        with self._lock:
+            cached = self._bodies.get(key)
+            if cached and cached[0] == self.version and not key.startswith(("data:", "status", "freshness")):
+                return cached[1], cached[2]
+            obj = self._render(key)
+            if obj is None:
+                return None
+            raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            etag = '"' + hashlib.sha1(raw).hexdigest()[:16] + '"'
+            self._bodies[key] = (self.version, raw, etag)
+            return raw, etag
+
+    def flush(self) -> bool:
+        """index.json + бандл на диск для статического хостинга, если что-то поменялось.
+        freshness.json пишется при любом новом результате."""
+        with self._lock:
+            version = self.version
+            fresh = dict(self.fresh) if self.fresh_dirty else {}
+            self.fresh_dirty = False
+            if version == self.flushed_version:
+                items = None
+            else:
+                items = [self.players[k] for k in sorted(self.players)]
+                aliases = dict(self.aliases)
+        save_freshness(self.out_dir, fresh)
+        if items is None:
+            return False
+        save_index(self.out_dir, items, compact=self.compact)
+        save_bundle(self.out_dir, build_bundle(items, self.data_dir, aliases))
+        with self._lock:
+            self.flushed_version = version
+        return True
+
+SERVE_ROUTES = {
+    "/index.json": "index",
+    "/bundle.json": "bundle",
+    "/status": "status",
+    "/freshness.json": "freshness",
+    "/data/teams.json": "data:teams.json",
+    "/data/playoff12.json": "data:playoff12.json",
+}
+
+def start_http(service: StatsService, host: str, port: int):
+    """ThreadingHTTPServer в фоновом потоке: GET c If-None-Match → 304."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            key = SERVE_ROUTES.get(path)
+            m = re.fullmatch(r"/(?:players/)?(\d+)\.json", path)
+            if key is None and m:
+                key = f"player:{m.group(1)}"
+            res = service.body(key) if key else None
+            if res is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            raw, etag = res
+            if etag in (self.headers.get("If-None-Match") or ""):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(raw)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(raw)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="serve-http", daemon=True).start()
+    return httpd
 
 # ─────────────────────────────────────────────
 # CLI
 
-def main():
+def cmd_history(argv: List[str]) -> None:
+    import argparse
+    ap = argparse.ArgumentParser(prog="scrape_lesta.py history", description="Запросы к истории снапшотов")
+    ap.add_argument("--out", type=str, default="stats", help="Папка со статистикой (default: stats)")
+    ap.add_argument("--history", type=str, help="Файл истории (default: <out>/history.sqlite)")
+    ap.add_argument("--id", type=int, help="Один аккаунт")
+    ap.add_argument("--since", type=str, help="Начало интервала / базовая точка (ISO, напр. 2026-08-20T00:00:00Z)")
+    ap.add_argument("--until", type=str, help="Конец интервала (ISO)")
+    ap.add_argument("--deltas", action="store_true", help="Изменения с --since для всех аккаунтов")
+    ap.add_argument("--write", type=str, help="Записать результат в файл (напр. stats/progress.json)")
+    args = ap.parse_args(argv)
+
+    path = pathlib.Path(args.history) if args.history else pathlib.Path(args.out) / "history.sqlite"
+    if not path.exists():
+        print(f"Нет файла истории: {path}")
+        return
+    store = HistoryStore(path)
+    try:
+        if args.deltas:
+            if not args.since:
+                ap.error("--deltas требует --since")
+            result = {"since": args.since, "players": store.deltas(args.since)}
+        elif args.id is not None and (args.since or args.until):
+            result = store.range(args.id, args.since, args.until)
+        else:
+            result = store.latest(args.id)
+    finally:
+        store.close()
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.write:
+        _atomic_write_text(pathlib.Path(args.write), text)
+    else:
+        print(text)
+
+def cmd_merge(argv: List[str]) -> None:
+    import argparse
+    ap = argparse.ArgumentParser(prog="scrape_lesta.py merge",
+                                 description="Слить partial-K-of-N.json шардов в stats/ и index.json")
+    ap.add_argument("partials", nargs="+", help="Файлы partial-*.json (или папки с ними)")
+    ap.add_argument("--out", type=str, default="stats", help="Папка для JSON (default: stats)")
+    ap.add_argument("--data", type=str, default="data", help="Папка с teams.json/playoff12.json для бандла (default: data)")
+    ap.add_argument("--input", type=str, help="participants.json — ники для бандла")
+    ap.add_argument("--no-bundle", action="store_true", help="Не собирать stats/bundle.<hash>.json")
+    ap.add_argument("--compact", action="store_true", help="stats/*.json и index.json без отступов (меньше байт на диске и в CDN)")
+    ap.add_argument("--history", type=str, help="SQLite с историей снапшотов (default: <out>/history.sqlite)")
+    ap.add_argument("--no-history", action="store_true", help="Не вести историю снапшотов")
+    args = ap.parse_args(argv)
+
+    out_dir = pathlib.Path(args.out)
+    paths: List[pathlib.Path] = []
+    for p in map(pathlib.Path, args.partials):
+        paths.extend(sorted(p.rglob("partial-*.json")) if p.is_dir() else [p])
+    if not paths:
+        print("Нет partial-*.json для слияния")
+        return
+
+    history = None
+    if not args.no_history:
+        history = HistoryStore(pathlib.Path(args.history) if args.history else out_dir / "history.sqlite")
+    try:
+        items, generated_at = merge_partials(out_dir, paths, history, compact=args.compact)
+    finally:
+        if history is not None:
+            history.close()
+    save_index(out_dir, items, generated_at, compact=args.compact)
+    print(f"Merge: {len(paths)} файл(ов), в индексе {len(items)} игроков")
+
+    if not args.no_bundle:
+        aliases = {}
+        if args.input:
+            aliases = {j["name"]: j["id"] for j in load_participants(pathlib.Path(args.input)) if j.get("name")}
+        name = save_bundle(out_dir, build_bundle(items, pathlib.Path(args.data), aliases))
+        print(f"Бандл: {out_dir / name}")
+
+def cmd_serve(argv: List[str]) -> None:
+    import argparse
+    ap = argparse.ArgumentParser(prog="scrape_lesta.py serve",
+                                 description="Демон: непрерывное обновление в фоне + локальный HTTP API")
+    ap.add_argument("--input", type=str, default="participants.json", help="Ростер (перечитывается каждый цикл)")
+    ap.add_argument("--out", type=str, default="stats", help="Папка для JSON (default: stats)")
+    ap.add_argument("--data", type=str, default="data", help="Папка с teams.json/playoff12.json (default: data)")
+    ap.add_argument("--host", type=str, default="127.0.0.1", help="Адрес HTTP API (default: 127.0.0.1)")
+    ap.add_argument("--port", type=int, default=8080, help="Порт HTTP API (default: 8080)")
+    ap.add_argument("--interval", type=str, default="5m", help="Пауза между циклами обновления (default: 5m)")
+    ap.add_argument("--max-age", type=str, default="30m", help="Не трогать профили, проверенные не позже этого (default: 30m)")
+    ap.add_argument("--flush-every", type=str, default="60s",
+                    help="Как часто сбрасывать index.json и бандл на диск при изменениях (default: 60s)")
+    ap.add_argument("--no-flush", action="store_true", help="Только HTTP API, index.json/бандл не переписывать")
+    ap.add_argument("--alive-only", action="store_true", help="Пропускать игроков команд, вылетевших из сетки")
+    ap.add_argument("--rate", type=float, default=1.0, help="Стартовая скорость, запросов/с на хост (default: 1)")
+    ap.add_argument("--min-rate", type=float, default=0.1, help="Нижняя граница скорости, запросов/с (default: 0.1)")
+    ap.add_argument("--max-rate", type=float, default=3.0, help="Верхняя граница скорости, запросов/с (default: 3)")
+    ap.add_argument("--concurrency", type=int, default=4, help="Сколько аккаунтов парсить одновременно (default: 4)")
+    ap.add_argument("--per-host", type=int, default=4, help="Максимум одновременных запросов к одному хосту (default: 4)")
+    ap.add_argument("--render-pool", type=int, default=2, help="Сколько страниц Chromium держать в пуле (default: 2)")
+    ap.add_argument("--render-recycle", type=int, default=50, help="Пересоздавать страницу после N рендеров (default: 50)")
+    ap.add_argument("--no-render", action="store_true", help="Не запускать Playwright-тир (статика → Jina)")
+    ap.add_argument("--render-mode", choices=("capture", "dom"), default="dom",
+                    help="dom — читать отрендеренный DOM; capture — ловить JSON-ответ профиля "
+                         "(экспериментально, на живом сайте не проверен; default: dom)")
+    ap.add_argument("--parse-pool", choices=("auto", "process", "thread", "inline"), default="auto",
+                    help="Где разбирать HTML: пул процессов, потоков или прямо в event loop; "
+                         "auto — процессы, если ядер больше одного (default: auto)")
+    ap.add_argument("--parse-workers", type=int, default=min(4, os.cpu_count() or 1),
+                    help="Размер пула парсеров (default: min(4, ядра))")
+    ap.add_argument("--write-batch", type=int, default=32, help="Сколько записей писатель сбрасывает за раз (default: 32)")
+    ap.add_argument("--compact", action="store_true", help="stats/*.json и index.json без отступов (меньше байт на диске и в CDN)")
+    ap.add_argument("--history", type=str, help="SQLite с историей снапшотов (default: <out>/history.sqlite)")
+    ap.add_argument("--no-history", action="store_true", help="Не вести историю снапшотов")
+    ap.add_argument("--router-state", type=str, help="JSON со статистикой тиров между циклами (напр. stats/.router.json)")
+    ap.add_argument("--app-id", type=str, help="application_id официального API (или env LESTA_APP_ID)")
+    ap.add_argument("--no-api", action="store_true", help="Не ходить в официальный API")
+    ap.add_argument("--no-archive", action="store_true", help="Не сохранять скачанные страницы в <out>/.archive")
+    ap.add_argument("--archive-keep", type=str, default="30d",
+                    help="Сколько хранить страницы в архиве, чистка раз в сутки (0 — не чистить; default: 30d)")
+    ap.add_argument("--cycles", type=int, default=0, help="Остановиться после N циклов (0 — работать до сигнала)")
+    args = ap.parse_args(argv)
+
+    out_dir = pathlib.Path(args.out)
+    data_dir = pathlib.Path(args.data)
+    interval = _parse_duration(args.interval)
+    flush_every = _parse_duration(args.flush_every)
+
+    service = StatsService(out_dir, data_dir, compact=args.compact)
+    httpd = start_http(service, args.host, args.port)
+    print(f"HTTP API: http://{args.host}:{httpd.server_address[1]}/index.json ({len(service.players)} игроков из индекса)")
+
+    sess = Session() if callable(Session) else Session
+    if hasattr(sess, "mount"):
+        adapter = _requests().adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(10, args.concurrency))
+        sess.mount("https://", adapter)
+        sess.mount("http://", adapter)
+    cache = FreshnessCache(out_dir, max_age=_parse_duration(args.max_age))
+    history = None
+    if not args.no_history:
+        history = HistoryStore(pathlib.Path(args.history) if args.history else out_dir / "history.sqlite")
+    router = TierRouter(tiers=TIERS if not args.no_render else tuple(t for t in TIERS if t != "render"))
+    if args.router_state:
+        router.load(pathlib.Path(args.router_state))
+    apply_preflight(router, preflight(out_dir, render=not args.no_render, network=False))
+    limiter = HostRateLimiter(rate=args.rate, min_rate=min(args.min_rate, args.rate), max_rate=args.max_rate)
+    app_id = None if args.no_api else api_app_id(args.app_id)
+    archive = None if args.no_archive else PageArchive(out_dir / PageArchive.DIR)
+
+    async def _flusher(stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=flush_every)
+            except asyncio.TimeoutError:
+                pass
+            if await asyncio.to_thread(service.flush):
+                print(f"Flush: index.json, {len(service.players)} игроков", flush=True)
+
+    async def _serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        flusher = None if args.no_flush else asyncio.create_task(_flusher(stop))
+        pool = BrowserPool(size=args.render_pool, max_uses=args.render_recycle, capture=args.render_mode == "capture")
+        # пул парсеров живёт весь процесс, как и браузер; статистику конвейера считаем по циклам
+        parser = ParserPool(args.parse_workers, args.parse_pool)
+
+        async def _cycle(cycle: int) -> Dict:
+            t0 = time.monotonic()
+            try:
+                jobs = dedup_jobs(iter_participants(pathlib.Path(args.input)))
+            except Exception as e:
+                print(f"Ростер не прочитан ({type(e).__name__}: {e}), ждём следующий цикл", flush=True)
+                jobs = []
+            service.set_aliases({j["name"]: j["id"] for j in jobs if j.get("name")})
+            jobs = PriorityScheduler(data_dir, service.players, cache, history).order(
+                jobs, alive_only=args.alive_only)
+            traces: List[Dict] = []
+            started_at = _now_iso()
+            pipeline = parser.stats = PipelineStats()
+            try:
+                if app_id:
+                    jobs, _ = await run_api_tier(
+                        jobs, out_dir, app_id, session=sess, cache=cache, prev_map=service.players,
+                        traces=traces, verbose=False, history=history, limiter=limiter,
+                        on_result=service.update, compact=args.compact,
+                    )
+                await run_jobs(
+                    jobs, out_dir, session=sess,
+                    concurrency=args.concurrency, per_host=args.per_host, limiter=limiter,
+                    pool=pool, cache=cache, prev_map=service.players, render=not args.no_render,
+                    history=history, router=router, traces=traces, verbose=False,
+                    collect=False, on_result=service.update, archive=archive,
+                    parser=parser, pipeline=pipeline, write_batch=args.write_batch, compact=args.compact,
+                )
+            finally:
+                # и прерванный цикл оставляет то, что успел: кэш, отметки свежести
+                service.touch(checked_stamps(traces))
+                cache.save()
+                if args.router_state:
+                    router.save(pathlib.Path(args.router_state))
+            summary = RunReport(traces, started_at, time.monotonic() - t0, router, limiter, pipeline).write(out_dir)
+            service.set_status(cycles=cycle, lastCycleAt=_now_iso(), lastCycle=summary["status"],
+                               lastError=None, router=router.summary())
+            return summary
+
+        cycle = 0
+        pruned_at = float("-inf")
+        stopped = asyncio.create_task(stop.wait())
+        try:
+            while not stop.is_set():
+                cycle += 1
+                t0 = time.monotonic()
+                task = asyncio.create_task(_cycle(cycle))
+                await asyncio.wait({task, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                if not task.done():
+                    # SIGINT/SIGTERM посреди цикла: не ждём весь ростер, отменяем
+                    task.cancel()
+                    try:
+                        await task
+                    except (asyncio.CancelledError, Exception):
+                        pass
+                    print(f"Цикл {cycle}: прерван по сигналу", flush=True)
+                    break
+                try:
+                    summary = task.result()
+                    print(f"Цикл {cycle}: {summary['status']}, {summary['wallSeconds']} с", flush=True)
+                except Exception as e:
+                    # упавший цикл не должен ронять демон: HTTP продолжает отдавать последние данные
+                    service.set_status(cycles=cycle, lastCycleAt=_now_iso(),
+                                       lastError=f"{type(e).__name__}: {e}")
+                    print(f"Цикл {cycle}: ошибка {type(e).__name__}: {e}", flush=True)
+                if archive is not None and time.monotonic() - pruned_at >= ARCHIVE_PRUNE_EVERY:
+                    pruned_at = time.monotonic()
+                    await asyncio.to_thread(prune_archive, archive, _parse_duration(args.archive_keep))
+                if args.cycles and cycle >= args.cycles:
+                    break
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=max(0.0, interval - (time.monotonic() - t0)))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            stop.set()
+            await stopped
+            if flusher is not None:
+                await flusher
+            parser.close()
+            await pool.close()
+
+    try:
+        asyncio.run(_serve())
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        cache.save()
+        if history is not None:
+            history.close()
+        if not args.no_flush:
+            service.flush()
+        print("serve: остановлен")
+
+def cmd_reparse(argv: List[str]) -> None:
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+    ap = argparse.ArgumentParser(prog="scrape_lesta.py reparse",
+                                 description="Пересобрать stats/*.json и index.json из архива страниц, без сети")
+    ap.add_argument("--out", type=str, default="stats", help="Папка для JSON (default: stats)")
+    ap.add_argument("--archive", type=str, help="Архив страниц (default: <out>/.archive)")
+    ap.add_argument("--data", type=str, default="data", help="Папка с teams.json/playoff12.json для бандла (default: data)")
+    ap.add_argument("--input", type=str, help="participants.json — ники для бандла")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Процессов для парсинга (default: все ядра)")
+    ap.add_argument("--no-bundle", action="store_true", help="Не собирать stats/bundle.<hash>.json")
+    ap.add_argument("--compact", action="store_true", help="stats/*.json и index.json без отступов (меньше байт на диске и в CDN)")
+    ap.add_argument("--dry-run", action="store_true", help="Только показать, что изменится")
+    args = ap.parse_args(argv)
+
+    out_dir = pathlib.Path(args.out)
+    archive = PageArchive(pathlib.Path(args.archive) if args.archive else out_dir / PageArchive.DIR)
+    refs = archive.latest_refs()
+    if not refs:
+        print(f"Архив пуст: {archive.root}")
+        return
+    prev_map = load_index(out_dir)
+    # Запись новее архивной (например, из официального API) не трогаем
+    refs = {acc: r for acc, r in refs.items()
+            if (r.get("fetchedAt") or "") >= ((prev_map.get(acc) or {}).get("fetchedAt") or "")}
+
+    t0 = time.monotonic()
+    root = str(archive.root)
+    items = sorted(refs.items())
+    if args.workers > 1 and len(items) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            results = list(ex.map(reparse_ref, [root] * len(items), [r for _, r in items],
+                                  chunksize=max(1, len(items) // (args.workers * 4))))
+    else:
+        results = [reparse_ref(root, r) for _, r in items]
+
+    changed = failed = 0
+    merged = dict(prev_map)
+    for acc, data in results:
+        if data is None or not is_good(data):
+            failed += 1
+            continue
+        if not same_stats(merged.get(acc), data):
+            changed += 1
+            if args.dry_run:
+                print(f"{acc}: изменится")
+            else:
+                save_json(out_dir, data, args.compact)
+            merged[acc] = data
+
+    print(f"Reparse: {len(items)} аккаунтов, изменилось {changed}, не разобрано {failed}, "
+          f"{time.monotonic() - t0:.2f} с")
+    if args.dry_run or not changed:
+        return
+    players = [merged[k] for k in sorted(merged)]
+    save_index(out_dir, players, compact=args.compact)
+    if not args.no_bundle:
+        aliases = {}
+        if args.input:
+            aliases = {j["name"]: j["id"] for j in load_participants(pathlib.Path(args.input)) if j.get("name")}
+        name = save_bundle(out_dir, build_bundle(players, pathlib.Path(args.data), aliases))
+        print(f"Бандл: {out_dir / name}")
+
+COMMANDS = {
+    "history": cmd_history,
+    "merge": cmd_merge,
+    "serve": cmd_serve,
+    "reparse": cmd_reparse,
+}
+
+# ─────────────────────────────────────────────
+# Прогон main(): общая обвязка обычного режима и --stream
+
+STREAM_CHUNK = 1000      # --stream: ростер идёт окнами — API-пачки и --priority внутри окна
+FRESHNESS_FLUSH = 5000   # --stream: отметки свежести сбрасываются в freshness.json пачками
+
+def _chunks(jobs: Iterable[Dict], n: int) -> Iterable[List[Dict]]:
+    chunk: List[Dict] = []
+    for job in jobs:
+        chunk.append(job)
+        if len(chunk) >= n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class ScrapeRun:
+    """Всё, что нужно одному прогону: кэш, история, роутер, темп, бюджет,
+    архив, статистика конвейера и сводка для отчёта.
+
+    Обычный режим и --stream отличаются только источником заданий и тем,
+    как собирается индекс; сама работа (API-тир, затем run_jobs) — в run().
+    """
+
+    def __init__(self, args, out_dir: pathlib.Path, sess, shard: Optional[Tuple[int, int]],
+                 checks: Dict[str, Tuple[bool, str]], app_id: Optional[str],
+                 on_trace: Optional[Callable[[Dict], None]] = None):
+        self.args = args
+        self.out_dir = out_dir
+        self.sess = sess
+        self.app_id = app_id
+        self.history_path = pathlib.Path(args.history) if args.history else out_dir / "history.sqlite"
+        self.cache = None if args.no_cache else FreshnessCache(out_dir, max_age=_parse_duration(args.max_age))
+        self.history = None
+        if not args.no_history and not shard:
+            # в шардах историю пишет merge
+            self.history = HistoryStore(self.history_path)
+        self.router = TierRouter(tiers=TIERS if not args.no_render else tuple(t for t in TIERS if t != "render"))
+        if args.router_state:
+            self.router.load(pathlib.Path(args.router_state))
+        apply_preflight(self.router, checks)
+        rate = (1.0 / args.delay) if args.delay else args.rate
+        self.limiter = HostRateLimiter(rate=rate, min_rate=min(args.min_rate, rate), max_rate=args.max_rate)
+        self.budget = parse_budget(args.budget) if args.budget else None
+        self.archive = None if args.no_archive else PageArchive(
+            pathlib.Path(args.archive) if args.archive else out_dir / PageArchive.DIR)
+        self.pipeline = PipelineStats()
+        self.traces = TraceStats(on_trace)
+        self.started_at, self.t_start = _now_iso(), time.monotonic()
+        self._sched: Optional[PriorityScheduler] = None
+        self._sched_history: Optional[HistoryStore] = None
+
+    def prioritize(self, jobs: List[Dict], prev_map, verbose: bool = True) -> List[Dict]:
+        """--priority/--alive-only: порядок и фильтр по PriorityScheduler."""
+        args = self.args
+        if not (args.priority or args.alive_only):
+            return jobs
+        if self._sched is None:
+            hist = self.history
+            if hist is None and not args.no_history and self.history_path.exists():
+                hist = self._sched_history = HistoryStore(self.history_path)
+            self._sched = PriorityScheduler(pathlib.Path(args.data), prev_map, self.cache, hist)
+        n = len(jobs)
+        jobs = self._sched.order(jobs, alive_only=args.alive_only)
+        if verbose:
+            top = ", ".join(f"{j['id']}:{self._sched.score(j)}" for j in jobs[:5])
+            print(f"Приоритет: {len(jobs)} из {n} аккаунтов, первые: {top or '-'}")
+        return jobs
+
+    async def run(self, chunks: Iterable[List[Dict]], prev_map, journal: RunJournal,
+                  collect: bool = True, on_result: Optional[Callable[[Dict], None]] = None,
+                  expected: Optional[int] = None) -> Dict[int, Dict]:
+        """Задания пачками: сначала официальный API (если есть app id), остаток — run_jobs.
+        Возвращает {accountId: data} удачных (при collect)."""
+        args = self.args
+        pool = BrowserPool(size=args.render_pool, max_uses=args.render_recycle, capture=args.render_mode == "capture")
+        parser = ParserPool(args.parse_workers, args.parse_pool, self.pipeline, expected=expected)
+        updated: Dict[int, Dict] = {}
+        try:
+            for chunk in chunks:
+                rest = chunk
+                if self.app_id:
+                    rest, via_api = await run_api_tier(
+                        chunk, self.out_dir, self.app_id, session=self.sess, cache=self.cache,
+                        prev_map=prev_map, traces=self.traces, history=self.history, journal=journal,
+                        limiter=self.limiter, budget=self.budget, on_result=on_result, compact=args.compact,
+                    )
+                    print(f"API: {len(via_api)} из {len(chunk)}, на скрапинг — {len(rest)}")
+                    if collect:
+                        updated.update(via_api)
+                scraped = await run_jobs(
+                    rest, self.out_dir, session=self.sess,
+                    concurrency=args.concurrency, per_host=args.per_host, limiter=self.limiter,
+                    pool=pool, cache=self.cache, prev_map=prev_map, render=not args.no_render,
+                    history=self.history, journal=journal, router=self.router, traces=self.traces,
+                    collect=collect, on_result=on_result, budget=self.budget, archive=self.archive,
+                    parser=parser, pipeline=self.pipeline, write_batch=args.write_batch, compact=args.compact,
+                )
+                updated.update(scraped)
+        finally:
+            parser.close()
+            await pool.close()
+        return updated
+
+    def close(self) -> None:
+        for h in (self.history, self._sched_history):
+            if h is not None:
+                h.close()
+        self.history = self._sched_history = None
+
+    def finish(self, suffix: str = "") -> Optional[Dict]:
+        """Итоги в консоль, состояние роутера и кэша на диск, run-report (если не --no-report)."""
+        print(f"Тиры: {self.router.summary()}")
+        if self.budget is not None:
+            print(f"Бюджет: {self.budget}")
+        if self.args.router_state:
+            self.router.save(pathlib.Path(self.args.router_state))
+        if self.cache:
+            self.cache.save()
+        if self.archive is not None:
+            prune_archive(self.archive, _parse_duration(self.args.archive_keep))
+        if self.args.no_report:
+            return None
+        report = RunReport(self.traces, self.started_at, time.monotonic() - self.t_start,
+                           self.router, self.limiter, self.pipeline)
+        summary = report.write(self.out_dir, suffix)
+        name = RunReport.JSON_FILE.replace(".json", suffix + ".json")
+        print(f"Отчёт: {self.out_dir / name} ({summary['status']}, {summary['wallSeconds']} с)")
+        return summary
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
     import argparse
     ap = argparse.ArgumentParser(description="Скрапер статистики танкистов (tanki.su)")
     ap.add_argument("--id", type=int, nargs="*", help="ID аккаунта(ов)")
     ap.add_argument("--url", type=str, nargs="*", help="Полные URL профилей")
-    ap.add_argument("--input", type=str, help="participants.json или participants.txt/csv")
+    ap.add_argument("--input", type=str, help="participants.json или participants.txt/csv/ndjson ('-' — stdin)")
     ap.add_argument("--out", type=str, default="stats", help="Папка для JSON (default: stats)")
-    ap.add_argument("--delay", type=float, default=1.2, help="Базовая пауза между запросами, сек (добавляется джиттер)")
-    args = ap.parse_args()
+    ap.add_argument("--rate", type=float, default=1.0, help="Стартовая скорость, запросов/с на хост (дальше подстраивается; default: 1)")
+    ap.add_argument("--min-rate", type=float, default=0.1, help="Нижняя граница скорости, запросов/с (default: 0.1)")
+    ap.add_argument("--max-rate", type=float, default=5.0, help="Верхняя граница скорости, запросов/с (default: 5)")
+    ap.add_argument("--delay", type=float, help="Устарело: то же, что --rate 1/DELAY")
+    ap.add_argument("--concurrency", type=int, default=4, help="Сколько аккаунтов парсить одновременно (default: 4)")
+    ap.add_argument("--per-host", type=int, default=4, help="Максимум одновременных запросов к одному хосту (default: 4)")
+    ap.add_argument("--render-pool", type=int, default=2, help="Сколько страниц Chromium держать в пуле (default: 2)")
+    ap.add_argument("--render-recycle", type=int, default=50, help="Пересоздавать страницу после N рендеров (default: 50)")
+    ap.add_argument("--no-render", action="store_true", help="Не запускать Playwright-тир (статика → Jina)")
+    ap.add_argument("--render-mode", choices=("capture", "dom"), default="dom",
+                    help="dom — читать отрендеренный DOM; capture — ловить JSON-ответ профиля, DOM — запасной путь "
+                         "(экспериментально, на живом сайте не проверен; default: dom)")
+    ap.add_argument("--parse-pool", choices=("auto", "process", "thread", "inline"), default="auto",
+                    help="Где разбирать HTML: пул процессов, потоков или прямо в event loop; "
+                         "auto — процессы, если ядер больше одного (default: auto)")
+    ap.add_argument("--parse-workers", type=int, default=min(4, os.cpu_count() or 1),
+                    help="Размер пула парсеров (default: min(4, ядра))")
+    ap.add_argument("--write-batch", type=int, default=32, help="Сколько записей писатель сбрасывает за раз (default: 32)")
+    ap.add_argument("--max-age", type=str, default="0", help="Не трогать профили, проверенные не позже этого (90s/45m/3h; default: 0 — выкл.)")
+    ap.add_argument("--no-cache", action="store_true", help="Без условных запросов и хэшей страниц (.fetch_cache.json)")
+    ap.add_argument("--history", type=str, help="SQLite с историей снапшотов (default: <out>/history.sqlite)")
+    ap.add_argument("--no-history", action="store_true", help="Не вести историю снапшотов")
+    ap.add_argument("--data", type=str, default="data", help="Папка с teams.json/playoff12.json для бандла (default: data)")
+    ap.add_argument("--no-bundle", action="store_true", help="Не собирать stats/bundle.<hash>.json")
+    ap.add_argument("--compact", action="store_true", help="stats/*.json и index.json без отступов (меньше байт на диске и в CDN)")
+    ap.add_argument("--no-report", action="store_true", help="Не писать run-report.json и scrape.prom")
+    ap.add_argument("--archive", type=str, help="Архив скачанных страниц для reparse (default: <out>/.archive)")
+    ap.add_argument("--no-archive", action="store_true", help="Не сохранять скачанные страницы")
+    ap.add_argument("--archive-keep", type=str, default="30d",
+                    help="Сколько хранить страницы в архиве (последняя по аккаунту — всегда; 0 — не чистить; default: 30d)")
+    ap.add_argument("--router-state", type=str, help="JSON со статистикой тиров между прогонами (напр. stats/.router.json)")
+    ap.add_argument("--resume", action="store_true", help="Продолжить прерванный прогон по журналу <out>/.journal.ndjson")
+    ap.add_argument("--shard", type=str, help="K/N: парсить только свой шард и писать <out>/partial-K-of-N.json (слить: merge)")
+    ap.add_argument("--priority", action="store_true",
+                    help="Сначала важные: живые команды сетки (data/playoff12.json), давно не обновлённые, активные")
+    ap.add_argument("--alive-only", action="store_true", help="Пропустить игроков команд, вылетевших из сетки")
+    ap.add_argument("--budget", type=str,
+                    help="Лимит на прогон: число запросов (300) или время (20m); остальное — в следующий раз")
+    ap.add_argument("--app-id", type=str, help="application_id официального API (или env LESTA_APP_ID); "
+                                                "с ним первым тиром идёт account/info пачками по 100")
+    ap.add_argument("--no-api", action="store_true", help="Не ходить в официальный API, даже если app id задан")
+    ap.add_argument("--stream", action="store_true",
+                    help="Потоковый режим для больших ростеров: парсить по мере чтения --input, "
+                         "индекс собирать из файлов игроков (без бандла)")
+    ap.add_argument("--check", action="store_true",
+                    help="Проверить Chromium, доступность хостов тиров и папку вывода и выйти (код 1 — не готово); "
+                         "с --id/--url/--input — выключить недоступные тиры и парсить дальше")
+    args = ap.parse_args(argv)
+    shard = parse_shard(args.shard) if args.shard else None
+    suffix = f"-{shard[0]}-of-{shard[1]}" if shard else ""
 
     out_dir = pathlib.Path(args.out)
+    app_id = None if args.no_api else api_app_id(args.app_id)
+    # Без --check проверяем только локальное (папка, Chromium) — это миллисекунды; сеть — по --check
+    checks = preflight(out_dir, render=not args.no_render, network=args.check, app_id=app_id)
+    if args.check:
+        print("Проверка окружения:")
+        print_preflight(checks)
+        if not (args.id or args.url or args.input):
+            ready = checks["out"][0] and any(ok for k, (ok, _) in checks.items() if k in TIERS)
+            return 0 if ready else 1
+    if not checks["out"][0]:
+        print(f"Папка вывода недоступна: {checks['out'][1]}")
+        return 1
+    if app_id and not checks.get("api", (True, ""))[0]:
+        print("Официальный API недоступен — прогон без него")
+        app_id = None
     sess = Session() if callable(Session) else Session
+    if hasattr(sess, "mount"):
+        # пул соединений под число воркеров, иначе urllib3 ругается и рвёт коннекты
+        adapter = _requests().adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(10, args.concurrency))
+        sess.mount("https://", adapter)
+        sess.mount("http://", adapter)
 
     jobs = []
 
@@ -480,6 +3939,9 @@ def main():
                     continue
             jobs.append({"id": acc, "name": name})
 
+    if args.stream:
+        return _main_stream(args, jobs, out_dir, sess, shard, suffix, checks, app_id)
+
     if args.input:
         jobs.extend(load_participants(pathlib.Path(args.input)))
 
@@ -487,43 +3949,140 @@ def main():
         print("Нечего парсить: укажи --id, --url или --input")
         return
 
-    # Дедуп по id
-    uniq = {}
-    for j in jobs:
-        uniq[j["id"]] = j.get("name")
-    jobs = [{"id": k, "name": v} for k, v in uniq.items()]
+    # Дедуп по id: порядок первого вхождения, пустой ник добирается из дублей
+    jobs = dedup_jobs(jobs)
+    jobs_all = jobs
+    if shard:
+        jobs = [j for j in jobs if shard_of(j["id"], shard[1]) == shard[0]]
+        print(f"Шард {shard[0]}/{shard[1]}: {len(jobs)} из {len(jobs_all)} аккаунтов")
+
+    # Журнал: при --resume пропускаем уже обработанные аккаунты
+    journal = RunJournal(out_dir, suffix)
+    resumed: Dict[int, Dict] = {}
+    if args.resume and journal.exists():
+        done_ids, resumed = journal.load()
+        jobs = [j for j in jobs if j["id"] not in done_ids]
+        print(f"Resume: уже обработано {len(done_ids)}, осталось {len(jobs)}")
+    elif journal.exists():
+        print("Найден журнал прерванного прогона — начинаем заново (для продолжения есть --resume)")
+    journal.open(resume=args.resume and journal.exists())
 
     # Загружаем предыдущий индекс для merge
     prev_map = load_index(out_dir)
-    updated_map: Dict[int, Dict] = {}
-
-    for i, job in enumerate(jobs, 1):
-        acc, name = job["id"], job.get("name")
-        print(f"[{i}/{len(jobs)}] {acc} ({name or '-'}) ... ", end="", flush=True)
+    checked: Dict[int, str] = {}
 
-        data = scrape_one(acc, name, session=sess)
+    def _checked(trace: Dict) -> None:
+        if trace.get("checkedAt"):
+            checked[trace["accountId"]] = trace["checkedAt"]
 
-        dst = out_dir / f"{acc}.json"
-        if is_good(data):
-            save_json(out_dir, data)
-            updated_map[acc] = data
-            print("OK")
-        else:
-            # При сбое не перезаписываем хороший файл
-            if dst.exists():
-                print("SKIP: keep previous stats")
-                # оставим в индексе старую запись (из prev_map), если есть
-            else:
-                print(f"ERR: {data.get('error','invalid data')}")
-            # ничего не кладём в updated_map
-        time.sleep(args.delay + random.uniform(0.5, 1.2))
+    run = ScrapeRun(args, out_dir, sess, shard, checks, app_id, on_trace=_checked)
+    try:
+        jobs = run.prioritize(jobs, prev_map)
+        updated_map = asyncio.run(run.run([jobs], prev_map, journal, expected=len(jobs)))
+    finally:
+        run.close()
+
+    if shard:
+        # Шард: только частичный результат, индекс собирает merge
+        updated_map = {**resumed, **updated_map}
+        path = save_partial(out_dir, shard[0], shard[1], list(updated_map.values()), run.cache)
+        journal.finish()
+        print(f"Partial: {path} ({len(updated_map)} обновлено)")
+        run.finish(suffix)
+        return
 
-    # Собираем индекс: старые + обновлённые
+    # Собираем индекс: старые + обновлённые (в т.ч. из журнала прерванного прогона).
+    # Если поменялся только fetchedAt, в индексе остаётся прошлая запись — свежесть в freshness.json
     merged = dict(prev_map)
-    merged.update(updated_map)
+    for acc, data in {**resumed, **updated_map}.items():
+        merged[acc] = stable_record(prev_map.get(acc), data)
     # Превращаем в список; можно сортировать по accountId
     items = [merged[k] for k in sorted(merged.keys())]
-    save_index(out_dir, items)
+    if not save_index(out_dir, items, compact=args.compact):
+        print("Индекс: статистика не поменялась, index.json не переписан")
+    save_freshness(out_dir, {**checked, **{acc: d.get("fetchedAt") for acc, d in {**resumed, **updated_map}.items()}})
+    journal.finish()
+
+    if not args.no_bundle:
+        aliases = {j["name"]: j["id"] for j in jobs_all if j.get("name")}
+        name = save_bundle(out_dir, build_bundle(items, pathlib.Path(args.data), aliases))
+        print(f"Бандл: {out_dir / name}")
+
+    run.finish()
+
+def _main_stream(args, jobs: List[Dict], out_dir: pathlib.Path, sess, shard: Optional[Tuple[int, int]],
+                 suffix: str, checks: Dict[str, Tuple[bool, str]], app_id: Optional[str]) -> None:
+    """main() для --stream: ни ростер, ни индекс целиком в памяти не держим.
+
+    Задания идут генератором (--id/--url, затем --input построчно) через дедуп,
+    фильтр шарда и журнал окнами по STREAM_CHUNK: в окне — --priority
+    (порядок только внутри окна), официальный API, остаток — run_jobs. Прошлые записи читаются
+    из <out>/<id>.json, индекс в конце пишется потоково из тех же файлов.
+    В памяти растут только множество id (дедуп) и сводка с ограниченными выборками.
+    """
+    if not jobs and not args.input:
+        print("Нечего парсить: укажи --id, --url или --input")
+        return
+
+    def _source() -> Iterable[Dict]:
+        # --id без ника — после ростера: если аккаунт там есть, возьмём его ник
+        yield from (j for j in jobs if j.get("name"))
+        if args.input:
+            yield from iter_participants(pathlib.Path(args.input))
+        yield from (j for j in jobs if not j.get("name"))
+
+    stream = dedup_stream(_source())
+    if shard:
+        stream = (j for j in stream if shard_of(j["id"], shard[1]) == shard[0])
+
+    journal = RunJournal(out_dir, suffix)
+    resume = args.resume and journal.exists()
+    resumed: Dict[int, Dict] = {}
+    if resume:
+        # файлы игроков уже на диске, но partial и отметки свежести их тоже должны увидеть
+        done_ids, resumed = journal.load()
+        stream = (j for j in stream if j["id"] not in done_ids)
+        print(f"Resume: уже обработано {len(done_ids)}")
+    elif journal.exists():
+        print("Найден журнал прерванного прогона — начинаем заново (для продолжения есть --resume)")
+    journal.open(resume=resume)
+
+    # Отметки свежести копятся пачкой и сбрасываются в freshness.json (в шарде их пишет merge)
+    fresh: Dict[int, str] = {}
+
+    def _stamp(acc: int, ts: Optional[str]) -> None:
+        if shard or not ts:
+            return
+        fresh[int(acc)] = ts
+        if len(fresh) >= FRESHNESS_FLUSH:
+            save_freshness(out_dir, fresh)
+            fresh.clear()
+
+    for acc, d in resumed.items():
+        _stamp(acc, d.get("fetchedAt"))
+    run = ScrapeRun(args, out_dir, sess, shard, checks, app_id,
+                    on_trace=lambda t: _stamp(t["accountId"], t.get("checkedAt")))
+    prev_map = PlayerFiles(out_dir)
+    if args.priority or args.alive_only:
+        print(f"Приоритет в --stream: порядок внутри окон по {STREAM_CHUNK} аккаунтов")
+    chunks = (run.prioritize(c, prev_map, verbose=False) for c in _chunks(stream, STREAM_CHUNK))
+    try:
+        updated_map = asyncio.run(run.run(
+            chunks, prev_map, journal, collect=bool(shard),
+            on_result=lambda d: _stamp(d["accountId"], d.get("fetchedAt"))))
+    finally:
+        run.close()
+
+    if shard:
+        updated_map = {**resumed, **updated_map}
+        path = save_partial(out_dir, shard[0], shard[1], list(updated_map.values()), run.cache)
+        print(f"Partial: {path} ({len(updated_map)} обновлено)")
+    else:
+        n = save_index_streaming(out_dir, compact=args.compact)
+        save_freshness(out_dir, fresh)
+        print(f"Индекс: {n} игроков (бандл в --stream не собирается)")
+    journal.finish()
+    run.finish(suffix)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())